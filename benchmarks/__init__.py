@@ -0,0 +1,5 @@
+"""
+Benchmarks of the toolkit on synthetic cohorts.
+
+Run from the repository root with: python -m benchmarks.run --help
+"""
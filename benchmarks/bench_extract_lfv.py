@@ -0,0 +1,49 @@
+"""
+Benchmarks the lofreq fast path of extract_lfv against PyVCF on the tutorial VCFs.
+
+Run from the repository root with: python benchmarks/bench_extract_lfv.py
+"""
+import os
+import sys
+import timeit
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from transmission_toolkit import VCFtools
+
+VCF_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'docs', 'tutorial_vcfs')
+REPEAT = 20
+
+def _pyvcf_file(path):
+    with open(path, 'r') as f:
+        yield from VCFtools._pyvcf_records(f)
+
+def _extract_all(paths, cached=False):
+    if not cached:
+        VCFtools.clear_cache()
+    return [VCFtools.extract_lfv(path, min_AF=0, max_AF=1) for path in paths]
+
+def main():
+    paths = sorted(os.path.join(VCF_DIR, fname) for fname in os.listdir(VCF_DIR))
+
+    # Both readers must agree record for record
+    for path in paths:
+        if list(VCFtools.read_records(path)) != list(_pyvcf_file(path)):
+            raise AssertionError(f'Fast reader disagrees with PyVCF on {path}')
+
+    fast = timeit.timeit(lambda: _extract_all(paths), number=REPEAT)
+    warm = timeit.timeit(lambda: _extract_all(paths, cached=True), number=REPEAT)
+    with mock.patch.object(VCFtools, 'read_records', _pyvcf_file):
+        expected = _extract_all(paths)
+        slow = timeit.timeit(lambda: _extract_all(paths), number=REPEAT)
+    if _extract_all(paths) != expected:
+        raise AssertionError('extract_lfv output changed with the fast reader')
+
+    print(f'{len(paths)} VCFs x {REPEAT} runs')
+    print(f'PyVCF:  {slow:.3f} s')
+    print(f'lofreq: {fast:.3f} s ({slow / fast:.1f}x faster)')
+    print(f'cached: {warm:.3f} s ({slow / warm:.1f}x faster)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmarks MultiFastaParser.get_groups against grouping by whole-sequence keys.
+
+Run from the repository root with: python benchmarks/bench_get_groups.py
+"""
+import os
+import sys
+import random
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from transmission_toolkit.FASTAtools import MultiFastaParser
+
+RECORDS = 500
+HAPLOTYPES = 25
+GENOME_LENGTH = 30000
+LINE_LENGTH = 80
+
+def _write_alignment(path, rng):
+    base = [rng.choice('ACGT') for _ in range(GENOME_LENGTH)]
+    haplotypes = []
+    for _ in range(HAPLOTYPES):
+        seq = list(base)
+        for pos in rng.sample(range(GENOME_LENGTH), 30):
+            seq[pos] = rng.choice('ACGT')
+        haplotypes.append(''.join(seq))
+    with open(path, 'w') as f:
+        for i in range(RECORDS):
+            seq = rng.choice(haplotypes)
+            f.write(f'>sample{i}\n')
+            f.write('\n'.join(seq[j: j+LINE_LENGTH] for j in range(0, len(seq), LINE_LENGTH)) + '\n')
+
+def _sequence_keys(parser):
+    """
+    Previous implementation: whole sequences as dictionary keys.
+    """
+    groups = dict()
+    for record in parser.records:
+        groups.setdefault(record.seq, set()).add(record.name)
+    return list(groups.values())
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'alignment.mfa')
+        _write_alignment(path, random.Random(0))
+
+        expected, slow, slow_mem = _measure(lambda: _sequence_keys(MultiFastaParser(path)))
+        groups, fast, fast_mem = _measure(lambda: MultiFastaParser(path).get_groups())
+        if sorted(map(sorted, groups)) != sorted(map(sorted, expected)):
+            raise AssertionError('get_groups disagrees with sequence-keyed grouping')
+
+    print(f'{RECORDS} records x {GENOME_LENGTH} bp, {len(groups)} groups')
+    print(f'sequence keys: {slow:.3f} s, peak {slow_mem / 2**20:.1f} MiB')
+    print(f'digests:       {fast:.3f} s, peak {fast_mem / 2**20:.1f} MiB')
+
+if __name__ == '__main__':
+    main()
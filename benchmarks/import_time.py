@@ -0,0 +1,86 @@
+"""
+Checks that importing the core modules stays fast and does not pull in the
+plotting or parsing libraries that are only needed by some functions.
+
+Each import is timed in a fresh interpreter, so the cost of starting Python is
+left out. Run from the repository root with: python -m benchmarks.import_time
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Modules that worker processes import, e.g. to call extract_lfv or vcf2fasta
+CORE_MODULES = [
+    'transmission_toolkit.VCFtools',
+    'transmission_toolkit.FASTAtools',
+    'transmission_toolkit.convertFile',
+]
+# Modules that should only load when a function needing them is called
+LAZY_MODULES = ['matplotlib', 'toytree', 'toyplot', 'Bio', 'vcf']
+# Modules whose import must not load LAZY_MODULES either
+NO_SIDE_EFFECT_MODULES = ['transmission_toolkit.visualize', 'transmission_toolkit.figures']
+BUDGET = 0.5 # Seconds allowed for importing CORE_MODULES
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # Imports run from the repository root
+REPEAT = 5 # Fresh interpreters timed; the fastest is kept
+
+SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - start
+loaded = sorted(name for name in {lazy!r} if name in sys.modules)
+print(json.dumps({{'seconds': elapsed, 'loaded': loaded}}))
+"""
+
+def measure(modules, repeat=REPEAT):
+    """
+    Imports modules in repeat fresh interpreters. Returns (fastest time in
+    seconds, LAZY_MODULES that were loaded). Raises ImportError if an import fails.
+    """
+    script = SCRIPT.format(modules=list(modules), lazy=LAZY_MODULES)
+    best, loaded = None, set()
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, cwd=ROOT)
+        if proc.returncode:
+            raise ImportError(proc.stderr.strip().splitlines()[-1])
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        best = result['seconds'] if best is None else min(best, result['seconds'])
+        loaded.update(result['loaded'])
+    return best, sorted(loaded)
+
+def main(argv=None):
+    """
+    Command line entry point. Exits with status 1 if the core imports are over
+    budget or any module loads a library that should be imported lazily.
+    """
+    parser = argparse.ArgumentParser(description='Checks the import time of the core modules.')
+    parser.add_argument('--budget', type=float, default=BUDGET, help='seconds allowed for the core imports')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    args = parser.parse_args(argv)
+
+    failures = []
+    seconds, loaded = measure(CORE_MODULES, args.repeat)
+    print(f'core imports: {seconds:.3f} s (budget {args.budget:.3f} s)')
+    if seconds > args.budget:
+        failures.append('core imports are over budget')
+    if loaded:
+        failures.append(f'importing the core modules loaded {", ".join(loaded)}')
+    for name in NO_SIDE_EFFECT_MODULES:
+        try:
+            _, loaded = measure([name], 1)
+        except ImportError as err:
+            failures.append(f'importing {name} failed: {err}')
+            continue
+        if loaded:
+            failures.append(f'importing {name} loaded {", ".join(loaded)}')
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
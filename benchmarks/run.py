@@ -0,0 +1,200 @@
+"""
+Times the main parsing and analysis functions on synthetic cohorts of several
+sizes, saves the timings as JSON and compares them with a stored baseline.
+
+Nothing here runs parsnp or RAxML. Benchmarks whose optional dependencies
+are missing are recorded as skipped.
+
+The baseline committed as benchmarks/baseline.json is compared against by
+default. Timings depend on the machine, so regenerate it on the machine that
+runs the comparison (and commit it again after an intended speed change) with:
+    python -m benchmarks.run --update-baseline
+
+Run from the repository root with, e.g.:
+    python -m benchmarks.run --sizes small medium
+    python -m benchmarks.run --baseline other_baseline.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+import numpy as np
+
+from transmission_toolkit import VCFtools
+from transmission_toolkit import masks as mask_module
+from transmission_toolkit import utils
+from transmission_toolkit.BB_Bottleneck import bb_input_data
+from transmission_toolkit.FASTAtools import MultiFastaParser
+from transmission_toolkit.distance import fasta_matrix, snp_distances
+from transmission_toolkit.visualize import _heatmap_matrix as heatmap_matrix
+
+from benchmarks.synthetic import AF_DISTRIBUTIONS, make_cohort
+
+# Cohort parameters of each size
+SIZES = {
+    'small': {'samples': 10, 'genome_length': 10000, 'variants_per_sample': 50},
+    'medium': {'samples': 50, 'genome_length': 30000, 'variants_per_sample': 200},
+    'large': {'samples': 200, 'genome_length': 30000, 'variants_per_sample': 1000},
+}
+REPEAT = 3 # Runs of each benchmark; the fastest is kept
+TOLERANCE = 0.25 # Slowdown relative to the baseline reported as a regression
+NOISE_FLOOR = 0.01 # Seconds a benchmark must also slow down by to count as a regression
+BB_PAIRS = 20 # Donor/recipient pairs parsed by the bb_input_data benchmark
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json') # Default baseline timings
+
+def _clear_caches():
+    VCFtools.clear_cache()
+    mask_module._cached_mask.cache_clear()
+    utils._cached_reference.cache_clear()
+
+def _extract_lfv(cohort):
+    return lambda: [VCFtools.extract_lfv(path, min_AF=0, max_AF=1) for path in cohort.vcf_paths]
+
+def _mask_parse(cohort):
+    return lambda: VCFtools.mask_parse(cohort.mask)
+
+def _majority_consensus(cohort):
+    return lambda: [VCFtools.build_majority_consensus(path, cohort.reference) for path in cohort.vcf_paths]
+
+def _minor_consensus(cohort):
+    return lambda: [VCFtools.build_minor_consensus(path, cohort.reference) for path in cohort.vcf_paths]
+
+def _get_groups(cohort):
+    return lambda: MultiFastaParser(cohort.alignment).get_groups()
+
+def _heatmap_matrix(cohort):
+    tables = VCFtools.load_variant_tables(cohort.vcf_dir)
+    names = sorted(tables)
+    return lambda: heatmap_matrix(tables, names, masks=cohort.mask)
+
+def _bb_input_data(cohort):
+    pairs = list(zip(cohort.vcf_paths, cohort.vcf_paths[1:]))[:BB_PAIRS]
+    return lambda: [bb_input_data(donor, recip, masks=cohort.mask) for donor, recip in pairs]
+
+def _snp_distances(cohort):
+    _, matrix = fasta_matrix(cohort.alignment)
+    return lambda: snp_distances(matrix, masks=cohort.mask)
+
+# Each benchmark sets up from a cohort and returns the function to time
+BENCHMARKS = {
+    'extract_lfv': _extract_lfv,
+    'mask_parse': _mask_parse,
+    'build_majority_consensus': _majority_consensus,
+    'build_minor_consensus': _minor_consensus,
+    'get_groups': _get_groups,
+    'heatmap_matrix': _heatmap_matrix,
+    'bb_input_data': _bb_input_data,
+    'snp_distances': _snp_distances,
+}
+
+def time_benchmark(setup, cohort, repeat=REPEAT):
+    """
+    Returns the fastest of repeat timed runs, in seconds, with the VCF, mask and
+    reference caches cleared before each run. Returns None if setup raises
+    ImportError, i.e. an optional dependency is missing.
+    """
+    try:
+        func = setup(cohort)
+    except ImportError as err:
+        print(f'  skipped: {err}')
+        return None
+    best = None
+    for _ in range(repeat):
+        _clear_caches()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(sizes, names=None, repeat=REPEAT, af_distribution='beta', seed=0):
+    """
+    Runs the named benchmarks (default: all) on a cohort of each size.
+
+    Returns {'meta': {...}, 'results': {size: {benchmark: seconds or None}}}.
+    """
+    results = {}
+    for size in sizes:
+        results[size] = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            cohort = make_cohort(tmp, af_distribution=af_distribution, seed=seed, **SIZES[size])
+            for name in names or BENCHMARKS:
+                print(f'{size} {name}')
+                results[size][name] = time_benchmark(BENCHMARKS[name], cohort, repeat)
+    meta = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'af_distribution': af_distribution,
+        'seed': seed,
+        'sizes': {size: SIZES[size] for size in sizes},
+    }
+    return {'meta': meta, 'results': results}
+
+def compare(report, baseline, tolerance=TOLERANCE, noise_floor=NOISE_FLOOR):
+    """
+    Prints each timing next to its baseline and returns the (size, benchmark)
+    pairs more than tolerance, and more than noise_floor seconds, slower than
+    the baseline.
+    """
+    regressions = []
+    print(f'{"size":8} {"benchmark":26} {"seconds":>10} {"baseline":>10} {"ratio":>7}')
+    for size, timings in report['results'].items():
+        for name, seconds in timings.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if seconds is None or base is None:
+                ratio = ''
+            else:
+                ratio = seconds / base if base else float('inf')
+                if ratio > 1 + tolerance and seconds - base > noise_floor:
+                    regressions.append((size, name))
+                ratio = f'{ratio:.2f}'
+            print(
+                f'{size:8} {name:26} {_fmt(seconds):>10} {_fmt(base):>10} {ratio:>7}'
+                + (' REGRESSION' if (size, name) in regressions else '')
+            )
+    return regressions
+
+def _fmt(seconds):
+    return '-' if seconds is None else f'{seconds:.4f}'
+
+def main(argv=None):
+    """
+    Command line entry point. Exits with status 1 if any benchmark regressed.
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks the toolkit on synthetic cohorts.')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium'])
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--af-distribution', choices=sorted(AF_DISTRIBUTIONS), default='beta')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to save timings to')
+    parser.add_argument('--baseline', default=BASELINE, help='JSON file of earlier timings to compare with')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--update-baseline', action='store_true', help='also save the timings as the baseline')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.only, args.repeat, args.af_distribution, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    baseline = {}
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance)
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f'Saved baseline to {args.baseline}.')
+    if regressions:
+        print(f'{len(regressions)} benchmark(s) more than {args.tolerance:.0%} slower than the baseline.')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
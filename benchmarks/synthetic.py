@@ -0,0 +1,131 @@
+"""
+Generates synthetic cohorts: a reference FASTA, one lofreq-style VCF per sample,
+a mask file and a multi-FASTA alignment of the samples' majority consensus.
+"""
+import os
+
+import numpy as np
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+AF_DISTRIBUTIONS = {'uniform', 'beta', 'bimodal'}
+SHARED_FRACTION = 0.7 # Fraction of each sample's variants drawn from a pool shared by the cohort
+LINE_LENGTH = 80 # Line length of the FASTA files written
+CHROM = 'synthetic'
+
+VCF_HEADER = """##fileformat=VCFv4.0
+##source=synthetic
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Raw Depth">
+##INFO=<ID=AF,Number=1,Type=Float,Description="Allele Frequency">
+##INFO=<ID=SB,Number=1,Type=Integer,Description="Phred-scaled strand bias at this position">
+##INFO=<ID=DP4,Number=4,Type=Integer,Description="Counts for ref-forward bases, ref-reverse, alt-forward and alt-reverse bases">
+##INFO=<ID=INDEL,Number=0,Type=Flag,Description="Indicates that the variant is an INDEL.">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+"""
+
+class SyntheticCohort:
+    """
+    Paths of the files of a generated cohort.
+    """
+    def __init__(self, output_dir, samples):
+        self.dir = output_dir
+        self.reference = os.path.join(output_dir, 'reference.fasta')
+        self.vcf_dir = os.path.join(output_dir, 'vcfs')
+        self.vcf_paths = [os.path.join(self.vcf_dir, f'sample{i}.vcf') for i in range(samples)]
+        self.mask = os.path.join(output_dir, 'mask.txt')
+        self.alignment = os.path.join(output_dir, 'alignment.mfa')
+
+def _frequencies(rng, count, af_distribution):
+    """
+    Draws allele frequencies from the named distribution.
+    """
+    if af_distribution == 'uniform':
+        freqs = rng.uniform(0.01, 1, count)
+    elif af_distribution == 'beta':
+        # Mostly low frequency variants, as in within-host data
+        freqs = rng.beta(0.5, 5, count)
+    elif af_distribution == 'bimodal':
+        freqs = np.where(rng.random(count) < 0.8, rng.beta(0.5, 5, count), rng.uniform(0.9, 1, count))
+    else:
+        raise ValueError(f'Unexpected af_distribution: {af_distribution}.')
+    return np.clip(freqs, 0.005, 1)
+
+def _write_fasta(f, name, seq):
+    f.write(f'>{name}\n')
+    f.write('\n'.join(seq[i: i+LINE_LENGTH] for i in range(0, len(seq), LINE_LENGTH)) + '\n')
+
+def _write_vcf(path, reference, positions, alts, freqs, rng):
+    depths = rng.integers(50, 2000, len(positions))
+    alt_counts = np.maximum(np.rint(freqs * depths).astype(np.int64), 1)
+    ref_counts = np.maximum(depths - alt_counts, 0)
+    ref_fwd = rng.binomial(ref_counts, 0.5)
+    alt_fwd = rng.binomial(alt_counts, 0.5)
+    lines = [VCF_HEADER]
+    for i, pos in enumerate(positions.tolist()):
+        dp4 = f'{ref_fwd[i]},{ref_counts[i] - ref_fwd[i]},{alt_fwd[i]},{alt_counts[i] - alt_fwd[i]}'
+        lines.append(
+            f'{CHROM}\t{pos}\t.\t{chr(reference[pos - 1])}\t{chr(alts[i])}\t100\tPASS\t'
+            f'DP={depths[i]};AF={freqs[i]:.6f};SB=0;DP4={dp4}\n'
+        )
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+def _write_mask(path, genome_length, rng, count=20):
+    """
+    Writes count masked positions and ranges, in the format read by mask_parse.
+    """
+    items = []
+    starts = rng.choice(np.arange(1, genome_length), size=min(count, genome_length - 1), replace=False)
+    for start in np.sort(starts).tolist():
+        if rng.random() < 0.5:
+            items.append(str(start))
+        else:
+            items.append(f'{start}-{min(start + int(rng.integers(2, 50)), genome_length)}')
+    with open(path, 'w') as f:
+        f.write(','.join(items) + '\n')
+
+def make_cohort(
+    output_dir,
+    samples=10,
+    genome_length=10000,
+    variants_per_sample=50,
+    af_distribution='beta',
+    seed=0
+    ):
+    """
+    Writes a synthetic cohort to output_dir and returns its SyntheticCohort.
+
+    Each sample draws most of its variant positions from a pool shared by the
+    cohort, so samples share variants as transmission pairs would.
+    """
+    if variants_per_sample > genome_length:
+        raise ValueError("Invalid input.")
+    rng = np.random.default_rng(seed)
+    cohort = SyntheticCohort(output_dir, samples)
+    os.makedirs(cohort.vcf_dir, exist_ok=True)
+
+    reference = rng.choice(BASES, genome_length)
+    with open(cohort.reference, 'w') as f:
+        _write_fasta(f, CHROM, reference.tobytes().decode('ascii'))
+
+    pool = rng.choice(np.arange(1, genome_length + 1), size=min(2 * variants_per_sample, genome_length), replace=False)
+    with open(cohort.alignment, 'w') as alignment:
+        _write_fasta(alignment, CHROM, reference.tobytes().decode('ascii'))
+        for i, path in enumerate(cohort.vcf_paths):
+            shared = rng.choice(pool, size=min(int(variants_per_sample * SHARED_FRACTION), len(pool)), replace=False)
+            private = rng.choice(np.arange(1, genome_length + 1), size=variants_per_sample - len(shared), replace=False)
+            positions = np.unique(np.concatenate([shared, private]))
+
+            # Alternative base is never the reference base
+            shift = rng.integers(1, 4, len(positions))
+            ref_idx = np.searchsorted(BASES, reference[positions - 1])
+            alts = BASES[(ref_idx + shift) % 4]
+            freqs = _frequencies(rng, len(positions), af_distribution)
+            _write_vcf(path, reference, positions, alts, freqs, rng)
+
+            consensus = reference.copy()
+            major = freqs > 0.5
+            consensus[positions[major] - 1] = alts[major]
+            _write_fasta(alignment, f'sample{i}', consensus.tobytes().decode('ascii'))
+
+    _write_mask(cohort.mask, genome_length, rng)
+    return cohort
@@ -0,0 +1,118 @@
+"""Fixtures writing the small VCF and FASTA files used by the tests"""
+import zlib
+import struct
+
+import pytest
+
+HEADER = """##fileformat=VCFv4.0
+##INFO=<ID=AF,Number=1,Type=Float,Description="Allele Frequency">
+{declared}#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+"""
+DECLARED = """##INFO=<ID=DP,Number=1,Type=Integer,Description="Raw Depth">
+##INFO=<ID=DP4,Number=4,Type=Integer,Description="Counts for ref-forward bases, ref-reverse, alt-forward and alt-reverse bases">
+"""
+REFERENCE = "ACGTACGTACGTACGT"
+LINEAR_SHIFT = 14 # Each linear index entry covers 2**14 bases
+# (shift, first bin) of each level of the tabix binning scheme, finest first
+BIN_LEVELS = ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1))
+
+def vcf_text(records, declared=True):
+    """
+    Returns a lofreq-style VCF holding records. Without declared, the header
+    leaves out DP and DP4, as some callers do.
+    """
+    return HEADER.format(declared=DECLARED if declared else '') + records
+
+def _bgzf_block(data):
+    """
+    Compresses data as one BGZF block.
+    """
+    compressor = zlib.compressobj(wbits=-15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = b'\x1f\x8b\x08\x04' + b'\0' * 4 + b'\0\xff' + struct.pack('<H2sHH', 6, b'BC', 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+@pytest.fixture
+def write_vcf(tmp_path):
+    """
+    Returns a function writing records to the VCF file tmp_path/name and returning its path.
+    """
+    def write(name, records, declared=True):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(vcf_text(records, declared))
+        return str(path)
+    return write
+
+def _reg2bin(beg, end):
+    """
+    Returns the smallest tabix bin holding [beg, end), 0-based.
+    """
+    end -= 1
+    for shift, first in BIN_LEVELS:
+        if beg >> shift == end >> shift:
+            return first + (beg >> shift)
+    return 0
+
+def _tabix_index(records, name):
+    """
+    Builds a tabix index of one sequence from (start, end, 0-based position, length) of each record.
+    """
+    bins, linear = {}, {}
+    for start, stop, beg, length in records:
+        chunks = bins.setdefault(_reg2bin(beg, beg + length), [])
+        if chunks and chunks[-1][1] == start:
+            chunks[-1][1] = stop
+        else:
+            chunks.append([start, stop])
+        for window in range(beg >> LINEAR_SHIFT, ((beg + length - 1) >> LINEAR_SHIFT) + 1):
+            linear.setdefault(window, start)
+    offsets = [0] * (max(linear) + 1 if linear else 0)
+    for window in range(len(offsets)):
+        offsets[window] = linear.get(window, offsets[window - 1] if window else 0)
+
+    index = b'TBI\x01' + struct.pack('<8i', 1, 2, 1, 2, 0, ord('#'), 0, len(name) + 1) + name.encode() + b'\0'
+    index += struct.pack('<i', len(bins))
+    for bin_id, chunks in bins.items():
+        index += struct.pack('<Ii', bin_id, len(chunks)) + b''.join(struct.pack('<QQ', *chunk) for chunk in chunks)
+    return index + struct.pack(f'<i{len(offsets)}Q', len(offsets), *offsets)
+
+@pytest.fixture
+def write_indexed_vcf(tmp_path):
+    """
+    Returns a function writing records to the bgzipped VCF file tmp_path/name,
+    lines_per_block records to a BGZF block, with its tabix index. Returns the VCF path.
+    """
+    def write(name, records, lines_per_block=None):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = [line.encode() for line in records.splitlines(True)]
+        lines_per_block = lines_per_block or max(len(lines), 1)
+        header = vcf_text('').encode()
+
+        # Virtual offsets are (block file offset << 16) | offset in the block's data
+        blocks, located, coffset = [], [], 0
+        for first in range(0, len(lines), lines_per_block):
+            data = header if first == 0 else b''
+            for line in lines[first: first + lines_per_block]:
+                fields = line.split(b'\t')
+                located.append(((coffset << 16) | len(data), (coffset << 16) | (len(data) + len(line)),
+                                int(fields[1]) - 1, len(fields[3])))
+                data += line
+            blocks.append(_bgzf_block(data))
+            coffset += len(blocks[-1])
+        path.write_bytes(b''.join(blocks or [_bgzf_block(header)]) + _bgzf_block(b''))
+
+        index = _tabix_index(located, lines[0].split(b'\t')[0].decode() if lines else 'chr')
+        (tmp_path / (name + '.tbi')).write_bytes(_bgzf_block(index) + _bgzf_block(b''))
+        return str(path)
+    return write
+
+@pytest.fixture
+def reference(tmp_path):
+    """
+    Path of a FASTA file holding REFERENCE.
+    """
+    path = tmp_path / 'ref.fasta'
+    path.write_text(f'>chr\n{REFERENCE}\n')
+    return str(path)
@@ -0,0 +1,74 @@
+"""Tests for writing BB_Bottleneck input files"""
+import os
+
+from transmission_toolkit import BB_Bottleneck
+from transmission_toolkit.cohort import CohortMatrix
+
+SAMPLES = {
+    'donor': """chr\t5\t.\tC\tA\t100\tPASS\tDP=100;AF=0.4;DP4=30,30,20,20
+chr\t9\t.\tG\tT\t100\tPASS\tDP=80;AF=0.1;DP4=36,36,4,4
+""",
+    'recip': """chr\t5\t.\tC\tA\t100\tPASS\tDP=90;AF=0.3;DP4=30,33,13,14
+""",
+}
+
+def _write_vcfs(write_vcf):
+    return [write_vcf(f'vcfs/{name}.vcf', records) for name, records in SAMPLES.items()]
+
+def _read(path):
+    with open(path, 'r') as f:
+        return os.path.basename(path), f.read()
+
+def test_pair_writers_agree(write_vcf, tmp_path):
+    donor, recip = _write_vcfs(write_vcf)
+
+    single = BB_Bottleneck.bb_file_writer(donor, recip, output_dir=str(tmp_path / 'single'))
+    written = BB_Bottleneck.write_all_pairs(str(tmp_path / 'vcfs'), output_dir=str(tmp_path / 'all'))
+    pair = [path for path in written if os.path.basename(path).startswith('new_donor_recip_')]
+    assert len(pair) == 1
+    assert _read(single) == _read(pair[0])
+
+    # One row per allele, REF included by default, sorted by position then allele
+    assert _read(single) == ('new_donor_recip_thred2_complete_nofilter_bbn.txt', '0.4\t0.3\n0.6\t0.7\n0.9\t0.0\n0.1\t0.0\n')
+    data, shared_count = BB_Bottleneck.bb_input_data(donor, recip)[:2]
+    assert shared_count == 2
+    assert data[5] == {'A': [0.4, 0.3], 'C': [0.6, 0.7]}
+
+def _contents(paths):
+    return sorted(_read(path) for path in paths)
+
+def test_saved_cohort_is_not_parsed_again(write_vcf, tmp_path, monkeypatch):
+    donor, recip = _write_vcfs(write_vcf)
+    vcf_dir = str(tmp_path / 'vcfs')
+    mask = tmp_path / 'mask.txt'
+    mask.write_text('5\n')
+
+    expected = {
+        'counts': BB_Bottleneck.all_pairs_parse(vcf_dir),
+        'histogram': BB_Bottleneck.shared_variant_histogram(vcf_dir, str(mask)),
+        'all': _contents(BB_Bottleneck.write_all_pairs(vcf_dir, output_dir=str(tmp_path / 'all'))),
+        'pair': _contents(BB_Bottleneck.write_pairs([(donor, recip)], output_dir=str(tmp_path / 'pair'))),
+    }
+    path = str(tmp_path / 'cohort.npz')
+    CohortMatrix.from_vcfs(vcf_dir, parse_type='biallelic', store_ref=True).save(path)
+
+    def parse(*args, **kwargs):
+        raise AssertionError('The VCF files were parsed again.')
+    monkeypatch.setattr(CohortMatrix, 'from_vcfs', parse)
+    cohort = CohortMatrix.load(path)
+    assert BB_Bottleneck.all_pairs_parse(cohort) == expected['counts']
+    assert BB_Bottleneck.shared_variant_histogram(cohort, str(mask)) == expected['histogram']
+    assert _contents(BB_Bottleneck.write_all_pairs(cohort, output_dir=str(tmp_path / 'all2'))) == expected['all']
+    written = BB_Bottleneck.write_pairs([('donor', 'recip')], output_dir=str(tmp_path / 'pair2'), cohort=cohort)
+    assert _contents(written) == expected['pair']
+
+def test_masked_positions_are_reported_when_hidden(write_vcf, tmp_path):
+    donor, recip = _write_vcfs(write_vcf)
+    mask = tmp_path / 'mask.txt'
+    mask.write_text('5\n')
+
+    hidden = BB_Bottleneck.bb_input_data(donor, recip, masks=str(mask))
+    highlighted = BB_Bottleneck.bb_input_data(donor, recip, masks=str(mask), mask_status='highlight')
+    assert hidden[2:] == highlighted[2:] == ([5], [5])
+    assert sorted(hidden[0]) == [9]
+    assert sorted(highlighted[0]) == [5, 9]
@@ -0,0 +1,97 @@
+"""Tests for the cohort matrix and the shared variant counts built on it"""
+import numpy as np
+import pytest
+
+from transmission_toolkit import BB_Bottleneck
+from transmission_toolkit.cohort import CohortMatrix
+from transmission_toolkit.masks import Mask
+
+COHORTS = 20 # Random cohorts compared with brute force set intersections
+MAX_SAMPLES = 40
+GENOME_LENGTH = 300
+BASES = 'ACGT'
+
+def _random_cohort(rng):
+    """
+    Returns a random CohortMatrix and each sample's set of (position, allele) variants.
+    """
+    n_samples = int(rng.integers(1, MAX_SAMPLES + 1))
+    keys = np.unique(rng.integers(0, GENOME_LENGTH * len(BASES), int(rng.integers(0, 200))))
+    positions, alleles = keys // len(BASES) + 1, np.array(list(BASES))[keys % len(BASES)]
+
+    indptr, indices = [0], []
+    for _ in range(n_samples):
+        row = np.flatnonzero(rng.random(len(keys)) < rng.uniform(0, 0.5))
+        indices.extend(row.tolist())
+        indptr.append(len(indices))
+    freq = rng.random(len(indices)).round(3)
+    depth = rng.integers(1, 1000, len(indices))
+    cohort = CohortMatrix(
+        [f'sample{i}' for i in range(n_samples)], positions, alleles, indptr, indices, freq, depth, {'store_ref': True}
+    )
+    variants = [
+        {(int(positions[col]), str(alleles[col])) for col in indices[indptr[i]: indptr[i + 1]]}
+        for i in range(n_samples)
+    ]
+    return cohort, variants
+
+def _brute_counts(variants, mask=None):
+    keep = lambda items: {item for item in items if mask is None or item[0] not in mask}
+    return np.array([[len(keep(a & b)) for b in variants] for a in variants], dtype=np.int64)
+
+@pytest.mark.parametrize('bitwise_count', [True, False])
+def test_shared_variant_counts_match_set_intersections(bitwise_count, monkeypatch):
+    if not bitwise_count:
+        # Use the lookup table popcount of NumPy versions without bitwise_count
+        monkeypatch.delattr(np, 'bitwise_count', raising=False)
+    rng = np.random.default_rng(0)
+    for _ in range(COHORTS):
+        cohort, variants = _random_cohort(rng)
+        assert np.array_equal(BB_Bottleneck.shared_variant_counts(cohort), _brute_counts(variants))
+
+        mask = Mask.from_positions(rng.choice(np.arange(1, GENOME_LENGTH + 1), 40, replace=False).tolist())
+        complete, masked = BB_Bottleneck.shared_variant_counts(cohort, mask)
+        assert np.array_equal(complete, _brute_counts(variants))
+        assert np.array_equal(masked, _brute_counts(variants, mask))
+
+def test_pair_vectors_match_variants():
+    rng = np.random.default_rng(1)
+    for _ in range(COHORTS):
+        cohort, _ = _random_cohort(rng)
+        donor, recipient = rng.choice(cohort.samples, 2)
+        shared, d_freq, r_freq, d_depth, r_depth = BB_Bottleneck.pair_vectors(cohort, donor, recipient)
+
+        donor_variants, recip_variants = cohort.variants(donor), cohort.variants(recipient)
+        assert shared == len(donor_variants.keys() & recip_variants.keys())
+        expected = [(value[0], recip_variants.get(key, [0.0, 0])[0], value[1], recip_variants.get(key, [0.0, 0])[1])
+                    for key, value in donor_variants.items()]
+        assert list(zip(d_freq.tolist(), r_freq.tolist(), d_depth.tolist(), r_depth.tolist())) == expected
+
+def test_select_matches_filtered_variants():
+    rng = np.random.default_rng(2)
+    for _ in range(COHORTS):
+        cohort, _ = _random_cohort(rng)
+        samples = rng.permutation(cohort.samples)[:int(rng.integers(1, len(cohort) + 1))].tolist()
+        start = int(rng.integers(1, GENOME_LENGTH))
+        position_range = (start, start + int(rng.integers(0, GENOME_LENGTH)))
+        min_AF, max_AF = sorted(rng.random(2).tolist())
+
+        selected = cohort.select(samples, position_range, min_AF, max_AF)
+        assert selected.samples == samples
+        for name in samples:
+            assert selected.variants(name) == {
+                (pos, allele): value for (pos, allele), value in cohort.variants(name).items()
+                if position_range[0] <= pos <= position_range[1] and min_AF <= value[0] < max_AF
+            }
+
+def test_save_and_load_round_trip(tmp_path):
+    cohort, _ = _random_cohort(np.random.default_rng(3))
+    path = str(tmp_path / 'cohort.npz')
+    cohort.save(path)
+
+    loaded = CohortMatrix.load(path)
+    assert loaded.samples == cohort.samples
+    assert loaded.params == cohort.params
+    for attr in ('positions', 'alleles', 'indptr', 'indices', 'freq', 'depth'):
+        assert np.array_equal(getattr(loaded, attr), getattr(cohort, attr))
+    assert np.array_equal(BB_Bottleneck.shared_variant_counts(loaded), BB_Bottleneck.shared_variant_counts(cohort))
@@ -0,0 +1,43 @@
+"""Tests for building consensus sequences of several samples"""
+from transmission_toolkit import VCFtools
+from transmission_toolkit.consensus import build_consensus_matrix
+from transmission_toolkit.utils import get_seq, load_reference
+
+SAMPLES = {
+    'insertion': """chr\t3\t.\tG\tGTT\t100\tPASS\tDP=100;AF=0.9;DP4=5,5,45,45
+chr\t8\t.\tT\tC\t100\tPASS\tDP=100;AF=0.2;DP4=40,40,10,10
+""",
+    'snp': """chr\t8\t.\tT\tC\t100\tPASS\tDP=100;AF=0.7;DP4=15,15,35,35
+""",
+}
+
+def _write_cohort(write_vcf):
+    return [write_vcf(f'{name}.vcf', records) for name, records in SAMPLES.items()]
+
+def test_matrix_matches_single_sample_consensus(write_vcf, reference):
+    paths = _write_cohort(write_vcf)
+
+    majority = build_consensus_matrix(paths, reference)
+    assert majority.names == ['insertion', 'snp']
+    assert list(majority.spliced) == ['insertion']
+    assert [majority.sequence(i) for i in range(2)] == [
+        VCFtools.build_majority_consensus(path, reference) for path in paths
+    ]
+
+    minor = build_consensus_matrix(paths, reference, consensus_type='minor', reference_name='ref')
+    assert minor.names == ['ref', 'insertion', 'snp']
+    assert minor.sequence(0) == get_seq(reference)
+    assert [minor.sequence(i) for i in (1, 2)] == [
+        VCFtools._minor_consensus(path, load_reference(reference), min_AF=0, max_AF=1) for path in paths
+    ]
+    assert sorted(sorted(group) for group in minor.get_groups()) == [['insertion'], ['ref', 'snp']]
+
+def test_unreadable_files_are_reported(write_vcf, reference, tmp_path):
+    paths = _write_cohort(write_vcf)
+    missing = str(tmp_path / 'missing.vcf')
+
+    errors = {}
+    consensus = build_consensus_matrix(paths + [missing], reference, errors=errors)
+    assert consensus.names == ['insertion', 'snp']
+    assert consensus.matrix.shape == (2, 16)
+    assert list(errors) == [missing]
@@ -0,0 +1,11 @@
+"""Tests that the core modules import quickly and load optional libraries lazily"""
+from benchmarks.import_time import BUDGET, CORE_MODULES, NO_SIDE_EFFECT_MODULES, measure
+
+def test_core_imports_are_fast_and_lazy():
+    seconds, loaded = measure(CORE_MODULES + ['transmission_toolkit.BB_Bottleneck'])
+    assert loaded == []
+    assert seconds <= BUDGET
+
+def test_plotting_modules_import_lazily():
+    for name in NO_SIDE_EFFECT_MODULES:
+        assert measure([name], 1)[1] == []
@@ -0,0 +1,63 @@
+"""Tests for directories holding bgzipped VCF files and their tabix indexes"""
+import os
+
+from transmission_toolkit import VCFtools, visualize
+from transmission_toolkit.consensus import build_consensus_matrix
+from transmission_toolkit.convertFile import vcf2fasta_batch
+from transmission_toolkit.manifest import Manifest
+from transmission_toolkit.utils import list_vcfs
+
+RECORDS = """chr\t5\t.\tA\tG\t100\tPASS\tDP=100;AF=0.7;DP4=15,15,35,35
+chr\t9\t.\tA\tT\t100\tPASS\tDP=100;AF=0.2;DP4=40,40,10,10
+"""
+
+def _write_inputs(write_vcf, write_indexed_vcf):
+    write_vcf('vcfs/plain.vcf', RECORDS)
+    return os.path.dirname(write_indexed_vcf('vcfs/indexed.vcf.gz', RECORDS))
+
+def test_indexes_are_not_listed(write_vcf, write_indexed_vcf, reference):
+    vcf_dir = _write_inputs(write_vcf, write_indexed_vcf)
+    paths = [os.path.join(vcf_dir, 'indexed.vcf.gz'), os.path.join(vcf_dir, 'plain.vcf')]
+    assert list_vcfs(vcf_dir) == paths
+
+    tables = VCFtools.load_variant_tables(vcf_dir)
+    assert sorted(tables) == ['indexed', 'plain']
+    assert VCFtools.load_variants(paths[0], region=(1, 6)).pos.tolist() == [5]
+
+    consensus = build_consensus_matrix(vcf_dir, reference)
+    assert consensus.names == ['indexed', 'plain']
+    assert consensus.sequence(0) == consensus.sequence(1) == 'ACGTGCGTACGTACGT'
+
+def test_vcf2fasta_batch_skips_indexes(write_vcf, write_indexed_vcf, reference, tmp_path):
+    vcf_dir = _write_inputs(write_vcf, write_indexed_vcf)
+
+    written, errors = vcf2fasta_batch(vcf_dir, reference, output_dir=str(tmp_path / 'fastas'), workers=1)
+    assert errors == {}
+    assert sorted(os.path.basename(path) for path in written) == ['indexed.vcf.gz', 'plain.vcf']
+    assert sorted(os.listdir(tmp_path / 'fastas')) == ['indexed.fna', 'plain.fna']
+
+def test_visualize_consensus_skips_indexes(write_vcf, write_indexed_vcf, reference, tmp_path):
+    vcf_dir = _write_inputs(write_vcf, write_indexed_vcf)
+    consensus_dir = str(tmp_path / 'consensus')
+
+    samples = visualize._update_consensus(vcf_dir, reference, consensus_dir, 1, Manifest(str(tmp_path)))
+    assert sorted(samples) == ['indexed', 'plain']
+    assert sorted(os.listdir(consensus_dir)) == ['indexed.fna', 'plain.fna']
+
+    vcfpaths, consensus = visualize._group_consensus({'indexed.fna', 'plain.fna'}, vcf_dir, reference)
+    assert vcfpaths == [os.path.join(vcf_dir, 'indexed.vcf.gz'), os.path.join(vcf_dir, 'plain.vcf')]
+    assert consensus.names == ['ref.fasta.ref', 'indexed', 'plain']
+    assert consensus.sequence(1) == consensus.sequence(2) == 'ACGTACGTTCGTACGT'
+
+def test_regions_starting_before_the_genome(write_vcf, write_indexed_vcf):
+    # Records spread over several BGZF blocks and tabix linear index windows
+    records = ''.join(
+        f'chr\t{pos}\t.\tA\tG\t100\tPASS\tDP=100;AF=0.2;DP4=40,40,10,10\n' for pos in range(1, 60000, 997)
+    )
+    plain = write_vcf('plain.vcf', records)
+    indexed = write_indexed_vcf('indexed.vcf.gz', records, lines_per_block=7)
+
+    for region in [(0, 1000), (-5, 100), (0, 60000), (1, 60000), (20000, 40000), (-10, 0)]:
+        expected = VCFtools.load_variants(plain, region=region).pos.tolist()
+        assert VCFtools.load_variants(indexed, region=region).pos.tolist() == expected
+    assert len(VCFtools.load_variants(indexed, region=(0, 60000))) == len(range(1, 60000, 997))
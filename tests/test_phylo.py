@@ -0,0 +1,44 @@
+"""Tests for building neighbor-joining trees in-process"""
+import numpy as np
+
+from transmission_toolkit import visualize
+from transmission_toolkit.consensus import ConsensusMatrix
+from transmission_toolkit.distance import sequence_matrix
+from transmission_toolkit.phylo import neighbor_joining, snp_tree
+
+# Additive distances of the usual five taxon example, with its known tree
+DISTANCES = [
+    [0, 5, 9, 9, 8],
+    [5, 0, 10, 10, 9],
+    [9, 10, 0, 8, 7],
+    [9, 10, 8, 0, 3],
+    [8, 9, 7, 3, 0],
+]
+TREE = '(((a:2,b:3):3,c:4):2,d:2,e:1);'
+
+# Sequences whose SNP distances fit a tree exactly
+NAMES = ['ref', 's1', 's2', 's3', 's4']
+SEQUENCES = ['AAAAAAAAAA', 'CAAAAAAAAA', 'CCAAAAAAAA', 'AAAGGAAAAA', 'AAAGGTAAAA']
+SNP_TREE = '((ref:0,(s3:0,s4:1):2):1,s1:0,s2:1);'
+
+def test_neighbor_joining_recovers_additive_tree():
+    assert neighbor_joining(np.array(DISTANCES), list('abcde')) == TREE
+
+def test_small_trees():
+    assert neighbor_joining(np.zeros((1, 1)), ['a']) == 'a;'
+    assert neighbor_joining(np.array([[0, 4], [4, 0]]), ['a', 'b c']) == "(a:2,'b c':2);"
+    assert neighbor_joining(np.array([[0, 3, 4], [3, 0, 5], [4, 5, 0]]), list('abc')) == '(a:1,b:2,c:3);'
+
+def test_snp_tree_of_sequences_and_matrix():
+    assert snp_tree(NAMES, SEQUENCES) == SNP_TREE
+    assert snp_tree(NAMES, sequence_matrix(SEQUENCES)) == SNP_TREE
+
+def test_fast_tree(tmp_path):
+    consensus = ConsensusMatrix(NAMES, sequence_matrix(SEQUENCES))
+    newick, refname = visualize._fast_tree(consensus, str(tmp_path / 'group'))
+    assert (newick, refname) == (SNP_TREE, 'ref')
+    assert (tmp_path / 'group' / 'tree.nwk').read_text() == SNP_TREE + '\n'
+
+    # Samples with multi-base alleles need aligning
+    spliced = ConsensusMatrix(NAMES, sequence_matrix(SEQUENCES), {'s1': 'CTTAAAAAAAAA'})
+    assert visualize._fast_tree(spliced, str(tmp_path / 'spliced')) is None
@@ -0,0 +1,71 @@
+"""Tests for reading VCF files"""
+import os
+
+import numpy as np
+import pytest
+
+from transmission_toolkit import VCFtools, variants
+
+RECORDS = """chr\t5\t.\tC\tA\t100\tPASS\tDP=85;AF=0.5;DP4=15,20,25,25
+chr\t9\t.\tG\tT\t100\tPASS\tDP=40;AF=0.1;DP4=18,18,2,2
+"""
+
+def test_undeclared_dp4_is_read_as_integers(write_vcf):
+    undeclared = write_vcf('undeclared.vcf', RECORDS, declared=False)
+    declared = write_vcf('declared.vcf', RECORDS)
+
+    records = list(VCFtools.read_records(undeclared))
+    assert records[0][3:5] == (85, [15, 20, 25, 25])
+
+    result = VCFtools.extract_lfv(undeclared, min_AF=0, max_AF=1)
+    assert result == VCFtools.extract_lfv(declared, min_AF=0, max_AF=1)
+    assert result[5]['A'] == [50 / 85, 50]
+
+def _open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+def _is_mapped(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+@pytest.fixture
+def cached_vcfs(write_vcf, tmp_path):
+    """
+    Writes VCF files, parses them into an on-disk cache and clears the session cache.
+    """
+    paths = [write_vcf(f'vcfs/sample{i}.vcf', RECORDS) for i in range(CACHED_FILES)]
+    VCFtools.warm_cache(str(tmp_path / 'vcfs'), cache_dir=str(tmp_path / 'cache'))
+    VCFtools.clear_cache()
+    yield paths
+    VCFtools.set_cache_dir(None)
+    VCFtools.clear_cache()
+
+CACHED_FILES = 60 # More cached tables than FD_HEADROOM allows file descriptors for
+FD_HEADROOM = 20 # Descriptors the test may open beyond those already open
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc to count file descriptors')
+def test_cached_tables_do_not_hold_file_descriptors(cached_vcfs, monkeypatch):
+    resource = pytest.importorskip('resource')
+    def reparse(*args, **kwargs):
+        raise AssertionError('A cached VCF was parsed again.')
+    monkeypatch.setattr(VCFtools, 'read_records', reparse)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (_open_fds() + FD_HEADROOM, hard))
+    try:
+        tables = [VCFtools.load_variants(path) for path in cached_vcfs]
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert all(table.pos.tolist() == [5, 9] and not _is_mapped(table.pos) for table in tables)
+
+    # Large tables are memory-mapped, one mapping each
+    VCFtools.clear_cache()
+    monkeypatch.setattr(variants, 'MMAP_THRESHOLD', 0)
+    before = _open_fds()
+    tables = [VCFtools.load_variants(path) for path in cached_vcfs[:FD_HEADROOM]]
+    assert _open_fds() - before <= FD_HEADROOM
+    assert all(_is_mapped(table.raw_depth) for table in tables)
+    assert tables[0].freq.tolist() == [50 / 85, 4 / 40]
@@ -1,87 +1,382 @@
 """Module containing classes and functions for parsing different types of data"""
 # Standard library import
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party import
+import numpy as np
 
 #Local import
-from transmission_toolkit.VCFtools import extract_lfv, build_majority_consensus
+from transmission_toolkit.cohort import CohortMatrix
+from transmission_toolkit.masks import Mask, load_mask
+from transmission_toolkit.utils import getpathleaf
+from transmission_toolkit.VCFtools import load_variants
+
+WRITERS = 4 # Threads writing BB_Bottleneck input files
+
+def _sample_name(vcf_file):
+    return getpathleaf(vcf_file).split('.')[0]
 
 def bb_input_data(donor, recip, min_read_depth=0, max_AF=1, parse_type="biallelic",  store_ref=True, weighted=False, masks=None, mask_status="hide"):
     """
     Stores info from parsing VCF files to dictionary.
+
+    Returns (bb_data, shared_count, donor_masks, recip_masks), where bb_data is
+    {pos: {var: [donor freq, recip freq]}} ([donor freq, recip freq, donor depth,
+    recip depth] if weighted) and the mask lists hold the masked positions at
+    which each sample has a variant, whether or not mask_status hides them.
     """
-    donor_data, donor_masks = extract_lfv(
-        donor, 
-        min_read_depth=min_read_depth, 
-        max_AF=max_AF, 
-        parse_type=parse_type, 
-        store_ref=store_ref, 
-        masks=masks, 
-        mask_status=mask_status
-    )
-    recip_data, recip_masks = extract_lfv(
-        recip, 
-        min_read_depth=min_read_depth, 
-        max_AF=max_AF, 
-        parse_type=parse_type, 
-        store_ref=store_ref, 
-        masks=masks, 
-        mask_status=mask_status
-    )
+    params = dict(max_AF=max_AF, parse_type=parse_type, store_ref=store_ref, min_read_depth=min_read_depth)
+    cohort = CohortMatrix.from_vcfs([donor, recip], masks=masks, mask_status=mask_status, **params)
+
+    donor_masks, recip_masks = [], []
+    if masks is not None:
+        mask = load_mask(masks)
+        donor_masks, recip_masks = [_masked_positions(vcf_file, mask, **params) for vcf_file in (donor, recip)]
 
-    shared_count = 0
+    donor, recip = _sample_name(donor), _sample_name(recip)
+    shared_count, d_freq, r_freq, d_depth, r_depth = pair_vectors(cohort, donor, recip)
 
-    # Stored as {pos: {var: [donor freq., recip. freq]}} bc Maria had two bb input files 
+    d_cols = cohort.row(donor)[0]
+    columns = [d_freq.tolist(), r_freq.tolist()]
+    if weighted:
+        columns += [d_depth.tolist(), r_depth.tolist()]
+
+    # Stored as {pos: {var: [donor freq., recip. freq]}} bc Maria had two bb input files
     # and one required all this info, might change later tho
-    bb_data = {} 
+    bb_data = {}
+    for pos, var, *values in zip(cohort.positions[d_cols].tolist(), cohort.alleles[d_cols].tolist(), *columns):
+        bb_data.setdefault(pos, {})[var] = values
 
-    # Iterate through each variant at each position
-    for pos in donor_data: 
+    return (bb_data, shared_count, donor_masks, recip_masks)
 
-        bb_data[pos] = {}
+def _masked_positions(vcf_file, mask, **params):
+    """
+    Returns the sorted masked positions at which a sample keeps a variant, filtering
+    its unmasked records as CohortMatrix.from_vcfs does with params.
+    """
+    reduced = load_variants(vcf_file).reduce(min_AF=0, **params)
+    return np.unique(reduced.pos[mask.contains(reduced.pos)]).tolist()
 
-        for var in donor_data[pos]:
+def bb_file_writer(donor, recipient, parse_type="biallelic", min_read_depth=0, max_AF=1, var_calling_threshold=0.03, weighted=False, output_dir="", store_ref=True):
+    """
+    Writes input file to BB_bottleneck software and returns its path.
+    See write_pairs for the format of the file.
+    """
+    return write_pairs(
+        [(donor, recipient)],
+        output_dir,
+        min_read_depth=min_read_depth,
+        max_AF=max_AF,
+        parse_type=parse_type,
+        store_ref=store_ref,
+        weighted=weighted,
+        var_calling_threshold=var_calling_threshold
+    )[0]
 
-            # Store donor data
-            donor_freq = donor_data[pos][var][0]
-            bb_data[pos] = {var: [donor_freq, 0.0]}
-            if weighted == True:
-                donor_depth = donor_data[pos][var][1]
-                bb_data[pos] = {var: [donor_freq, 0.0, donor_depth, 0.0]}
+def pair_vectors(cohort, donor, recipient):
+    """
+    Pairs up a donor's variants with the recipient's frequencies and depths.
 
-            # If recipient has same variant at same location, store it
-            if pos in recip_data and var in recip_data[pos]:
-                recip_freq = recip_data[pos][var][0]
-                bb_data[pos][var][1] = recip_freq
-                shared_count += 1
-                if weighted == True:
-                    recip_depth = recip_data[pos][var][1]
-                    bb_data[pos][var][3] = recip_depth
+    Returns (shared count, donor freqs, recipient freqs, donor depths, recipient depths),
+    with a recipient frequency and depth of 0 for variants the recipient lacks.
+    """
+    d_cols, d_freq, d_depth = cohort.row(donor)
+    r_cols, r_freq, r_depth = cohort.row(recipient)
 
+    # Both rows are sorted by column, so matches are found with a binary search
+    if len(r_cols):
+        idx = np.searchsorted(r_cols, d_cols).clip(max=len(r_cols) - 1)
+        shared = r_cols[idx] == d_cols
+        recip_freq = np.where(shared, r_freq[idx], 0.0)
+        recip_depth = np.where(shared, r_depth[idx], 0)
+    else:
+        shared = np.zeros(len(d_cols), dtype=bool)
+        recip_freq = np.zeros(len(d_cols), dtype=np.float64)
+        recip_depth = np.zeros(len(d_cols), dtype=np.int64)
+    return int(shared.sum()), d_freq, recip_freq, d_depth, recip_depth
 
-    return (bb_data, shared_count, donor_masks, recip_masks)
-    
-def bb_file_writer(donor, recipient, parse_type="biallelic", min_read_depth=0, max_AF=1, var_calling_threshold=0.03):
+def _popcount(words):
     """
-    Writes input file to BB_bottleneck software.
+    Counts the set bits of every element of a uint64 array.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return table[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def _pack_columns(cohort, columns):
+    """
+    Packs each sample's variants among the given columns into a row of uint64 bitset words.
+    """
+    n_samples = len(cohort)
+    position = np.full(len(cohort.positions), -1, dtype=np.int64)
+    position[columns] = np.arange(len(columns))
+    n_words = max((len(columns) + 63) // 64, 1)
+    bits = np.zeros((n_samples, n_words * 8), dtype=np.uint8)
+
+    rows = np.repeat(np.arange(n_samples), np.diff(cohort.indptr))
+    bit = position[cohort.indices]
+    rows, bit = rows[bit >= 0], bit[bit >= 0]
+    np.bitwise_or.at(bits, (rows, bit >> 3), (128 >> (bit & 7)).astype(np.uint8))
+    return bits.view(np.uint64)
+
+def _bitset_counts(cohort, column_sets):
+    """
+    Returns one (n x n) shared variant count matrix per set of columns, computed
+    in a single pass of AND and popcount over packed bitsets.
+    """
+    # Columns held by a single sample only count towards the diagonal
+    samples_per_column = np.bincount(cohort.indices, minlength=len(cohort.positions))
+    shared_columns = [columns[samples_per_column[columns] > 1] for columns in column_sets]
+    words = [_pack_columns(cohort, columns) for columns in shared_columns]
+    bounds = np.cumsum([0] + [w.shape[1] for w in words])
+    words = np.hstack(words)
+
+    n_samples = len(cohort)
+    rows = np.repeat(np.arange(n_samples), np.diff(cohort.indptr))
+    counts = []
+    for columns in column_sets:
+        count = np.zeros((n_samples, n_samples), dtype=np.int64)
+        in_set = np.zeros(len(cohort.positions), dtype=bool)
+        in_set[columns] = True
+        count[np.diag_indices(n_samples)] = np.bincount(rows[in_set[cohort.indices]], minlength=n_samples)
+        counts.append(count)
+
+    for i in range(n_samples - 1):
+        shared = _popcount(words[i] & words[i + 1:])
+        for k, count in enumerate(counts):
+            count[i, i + 1:] = shared[:, bounds[k]:bounds[k + 1]].sum(axis=1)
+            count[i + 1:, i] = count[i, i + 1:]
+    return counts
+
+def shared_variant_counts(cohort, masks=None):
+    """
+    Returns an (n x n) array holding the number of (position, allele) variants
+    shared by every pair of samples, counted with packed bitsets.
+
+    If masks (a mask file or Mask) is given, returns (complete, masked) count
+    arrays from the same pass, where masked ignores variants at masked positions.
+    """
+    if masks is None:
+        return _bitset_counts(cohort, [np.arange(len(cohort.positions))])[0]
+    if not isinstance(masks, Mask):
+        masks = load_mask(masks)
+    in_mask = masks.contains(cohort.positions)
+    unmasked, masked = _bitset_counts(cohort, [np.flatnonzero(~in_mask), np.flatnonzero(in_mask)])
+    return unmasked + masked, unmasked
+
+def shared_position_counts(cohort):
+    """
+    Returns {position: number of ordered sample pairs sharing a variant at that position}.
+    """
+    samples_per_column = np.bincount(cohort.indices, minlength=len(cohort.positions))
+    pairs = samples_per_column * (samples_per_column - 1)
+    positions, group = np.unique(cohort.positions, return_inverse=True)
+    totals = np.bincount(group, weights=pairs, minlength=len(positions))
+    return {pos: int(total) for pos, total in zip(positions.tolist(), totals.tolist()) if total}
+
+def _cohort(vcf_files, **params):
     """
-    # Parse data and store outputs
-    parsed_data = bb_input_data(
-        donor,
-        recipient,
+    Returns vcf_files itself if it is a CohortMatrix, e.g. one loaded with
+    CohortMatrix.load, and otherwise parses the VCF files with params.
+    """
+    if isinstance(vcf_files, CohortMatrix):
+        return vcf_files
+    return CohortMatrix.from_vcfs(vcf_files, **params)
+
+def select_pairs(cohort, pair_filter=None, distances=None, max_distance=None):
+    """
+    Returns the ordered (donor, recipient) pairs of samples that pass the filters.
+
+    pair_filter is called as pair_filter(donor, recipient) and should return True
+    for pairs to keep, e.g. based on sampling metadata. distances is a square array
+    ordered like cohort.samples; pairs further apart than max_distance are dropped.
+    """
+    keep = ~np.eye(len(cohort), dtype=bool)
+    if max_distance is not None:
+        keep &= np.asarray(distances) <= max_distance
+    pairs = []
+    for i, j in zip(*np.nonzero(keep)):
+        donor, recipient = cohort.samples[i], cohort.samples[j]
+        if pair_filter is None or pair_filter(donor, recipient):
+            pairs.append((donor, recipient))
+    return pairs
+
+def all_pairs_parse(
+    vcf_dir,
+    masks=None,
+    mask_status='hide',
+    min_read_depth=0,
+    min_AF=0,
+    max_AF=1,
+    parse_type='biallelic',
+    store_ref=True,
+    pair_filter=None,
+    distances=None,
+    max_distance=None
+    ):
+    """
+    Parses every VCF file once and returns {(donor, recipient): shared variant count}
+    for all ordered pairs of samples that pass the pair filters (see select_pairs).
+
+    vcf_dir may also be a CohortMatrix, which is used as built and not re-parsed.
+    """
+    cohort = _cohort(
+        vcf_dir,
+        min_AF=min_AF,
+        max_AF=max_AF,
         parse_type=parse_type,
-        min_read_depth=min_read_depth,
-        max_AF=max_AF)
-        
-    vcf_data, shared_count = parsed_data[0], parsed_data[1]
-
-    # Create shortened filenames
-    fname1 = donor.split("_")[0] 
-    fname2 = recipient.split("_")[0]
-
-    # Write data to file in BB_Bottleneck input format
-    filename = f"new_{fname1}_{fname2}_thred{shared_count}_complete_nofilter_bbn.txt"
-    with open(filename, "w") as f:
-        for pos in vcf_data:
-            for var in vcf_data[pos]:
-                if vcf_data[pos][var][0] > var_calling_threshold:
-                    f.write(str(vcf_data[pos][var][0])+'\t'+str(vcf_data[pos][var][1])+'\n')
\ No newline at end of file
+        store_ref=store_ref,
+        masks=masks,
+        mask_status=mask_status,
+        min_read_depth=min_read_depth
+    )
+    counts = shared_variant_counts(cohort)
+    index = cohort.sample_index
+    return {
+        (donor, recipient): int(counts[index[donor], index[recipient]])
+        for donor, recipient in select_pairs(cohort, pair_filter, distances, max_distance)
+    }
+
+def shared_variant_histogram(
+    vcf_dir,
+    masks,
+    min_read_depth=0,
+    min_AF=0,
+    max_AF=1,
+    parse_type='biallelic',
+    store_ref=True
+    ):
+    """
+    Returns {number of shared variants: [complete pairs, masked pairs]}, counting
+    ordered pairs of samples over the complete genome and with masked positions hidden.
+
+    Both counts come from a single parse of vcf_dir and a single bitset pass.
+    vcf_dir may also be a CohortMatrix built without masks, which is not re-parsed.
+    """
+    cohort = _cohort(
+        vcf_dir,
+        min_AF=min_AF,
+        max_AF=max_AF,
+        parse_type=parse_type,
+        store_ref=store_ref,
+        min_read_depth=min_read_depth
+    )
+    complete, masked = shared_variant_counts(cohort, masks)
+    off_diagonal = ~np.eye(len(cohort), dtype=bool)
+    complete = np.bincount(complete[off_diagonal], minlength=1)
+    masked = np.bincount(masked[off_diagonal], minlength=1)
+    size = max(len(complete), len(masked))
+    complete = np.pad(complete, (0, size - len(complete))).tolist()
+    masked = np.pad(masked, (0, size - len(masked))).tolist()
+    return {n: [complete[n], masked[n]] for n in range(size) if complete[n] or masked[n]}
+
+def bb_filename(donor, recipient, shared_count):
+    """
+    Returns the name of the BB_Bottleneck input file of a donor/recipient pair.
+    """
+    return f"new_{donor}_{recipient}_thred{shared_count}_complete_nofilter_bbn.txt"
+
+def _write_pair(cohort, donor, recipient, output_dir, weighted, var_calling_threshold):
+    shared_count, d_freq, r_freq, d_depth, r_depth = pair_vectors(cohort, donor, recipient)
+    called = d_freq > var_calling_threshold
+    columns = [d_freq[called].tolist(), r_freq[called].tolist()]
+    if weighted:
+        columns += [d_depth[called].tolist(), r_depth[called].tolist()]
+    path = os.path.join(output_dir, bb_filename(donor, recipient, shared_count))
+    with open(path, "w") as f:
+        f.write(''.join('\t'.join(map(str, row)) + '\n' for row in zip(*columns)))
+    return path
+
+def _write_pairs(cohort, pairs, output_dir, weighted, var_calling_threshold, workers):
+    if output_dir and not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(
+            lambda pair: _write_pair(cohort, pair[0], pair[1], output_dir, weighted, var_calling_threshold),
+            pairs
+        ))
+
+def write_pairs(
+    pairs,
+    output_dir="",
+    masks=None,
+    mask_status='hide',
+    min_read_depth=0,
+    min_AF=0,
+    max_AF=1,
+    parse_type='biallelic',
+    store_ref=True,
+    weighted=False,
+    var_calling_threshold=0.03,
+    workers=WRITERS,
+    cohort=None
+    ):
+    """
+    Writes a BB_Bottleneck input file for every (donor VCF, recipient VCF) pair,
+    parsing each VCF file only once.
+
+    Each file has one row per donor allele whose frequency is above
+    var_calling_threshold: the donor and recipient frequencies, tab-separated,
+    followed by the two depths if weighted. The recipient frequency is 0 if it
+    lacks the allele. With store_ref (the default) the REF allele of each
+    position gets its own row next to the ALT alleles, as BB_Bottleneck models
+    every allele of a site. Rows are sorted by position and then alphabetically
+    by allele, so the output is deterministic.
+
+    If cohort (a CohortMatrix) is given, the pairs are looked up in it by sample
+    name instead of being parsed, and may also be given as sample names.
+    Files are written by a pool of threads. Returns the paths written.
+    """
+    vcf_files = sorted({vcf_file for pair in pairs for vcf_file in pair})
+    cohort = _cohort(
+        cohort if cohort is not None else vcf_files,
+        min_AF=min_AF,
+        max_AF=max_AF,
+        parse_type=parse_type,
+        store_ref=store_ref,
+        masks=masks,
+        mask_status=mask_status,
+        min_read_depth=min_read_depth
+    )
+    pairs = [(_sample_name(donor), _sample_name(recipient)) for donor, recipient in pairs]
+    return _write_pairs(cohort, pairs, output_dir, weighted, var_calling_threshold, workers)
+
+def write_all_pairs(
+    vcf_dir,
+    output_dir="",
+    masks=None,
+    mask_status='hide',
+    min_read_depth=0,
+    min_AF=0,
+    max_AF=1,
+    parse_type='biallelic',
+    store_ref=True,
+    weighted=False,
+    var_calling_threshold=0.03,
+    pair_filter=None,
+    distances=None,
+    max_distance=None,
+    workers=WRITERS
+    ):
+    """
+    Writes a BB_Bottleneck input file for every ordered pair of samples in vcf_dir
+    that passes the pair filters, parsing each VCF file only once. vcf_dir may
+    also be a CohortMatrix, which is used as built and not re-parsed.
+
+    Files have the format described in write_pairs and are written by a pool
+    of threads. Returns the paths written.
+    """
+    cohort = _cohort(
+        vcf_dir,
+        min_AF=min_AF,
+        max_AF=max_AF,
+        parse_type=parse_type,
+        store_ref=store_ref,
+        masks=masks,
+        mask_status=mask_status,
+        min_read_depth=min_read_depth
+    )
+    pairs = select_pairs(cohort, pair_filter, distances, max_distance)
+    return _write_pairs(cohort, pairs, output_dir, weighted, var_calling_threshold, workers)
@@ -2,9 +2,18 @@
 
 import os
 import glob
+import mmap
 import errno
-import subprocess
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
 
+import numpy as np
+
+from transmission_toolkit import profiling
+from transmission_toolkit.masks import Mask, load_mask
+from transmission_toolkit.profiling import profiled
 from transmission_toolkit.utils import getpathleaf
 from transmission_toolkit.VCFtools import extract_lfv, build_majority_consensus, build_minor_consensus
 
@@ -16,13 +25,49 @@ class FastaAligner:
 
     This class is meant for handling FASTA files with one sequence per file, and will raise
     an error if given a multi-FASTA file.
+
+    Genomes can be given as a directory of FASTA files, a list of FASTA file
+    paths or an iterable of in-memory FastaRecord objects. Lists and records are
+    only written to a temporary directory while parsnp runs.
     """
     def __init__(self, fasta_dir):
-        if os.path.isdir(fasta_dir):
+        self.dir, self.files, self.records = None, None, None
+        if isinstance(fasta_dir, (str, os.PathLike)):
+            if not os.path.isdir(fasta_dir):
+                raise ValueError("The specified path should be a directory of fasta files.")
             self.dir = fasta_dir
         else:
-            raise ValueError("The specified path should be a directory of fasta files.")
+            items = list(fasta_dir)
+            if all(isinstance(item, (str, os.PathLike)) for item in items):
+                self.files = [os.path.abspath(item) for item in items]
+            elif all(isinstance(item, FastaRecord) for item in items):
+                self.records = items
+            else:
+                raise ValueError("Expected a directory, a list of fasta files or FastaRecord objects.")
 
+    @contextmanager
+    def _genome_dir(self, output_dir):
+        """
+        Yields a directory holding one FASTA file per genome, as parsnp expects,
+        creating a temporary one in output_dir if needed.
+        """
+        if self.dir is not None:
+            yield self.dir
+            return
+        tmp = tempfile.mkdtemp(prefix='genomes_', dir=output_dir or None)
+        try:
+            if self.files is not None:
+                for path in self.files:
+                    os.symlink(path, os.path.join(tmp, getpathleaf(path)))
+            else:
+                for record in self.records:
+                    with open(os.path.join(tmp, record.name + '.fna'), 'w') as f:
+                        f.write(f'>{record.name}\n{record.seq}\n')
+            yield tmp
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @profiled()
     def align(self, reference, output_dir='', threads=THREADS):
         """
         Given a reference genome file, aligns all fasta files in directory using Parsnp.
@@ -33,12 +78,16 @@ class FastaAligner:
             os.mkdir(output_dir)
         
         output = os.path.join(os.getcwd(), output_dir)
-        cmnd = f"parsnp -d {self.dir} -r {reference} -o {output} -p {threads}"
-        subprocess.call(cmnd.split())
+        with self._genome_dir(output_dir) as genome_dir:
+            profiling.add_records(len(os.listdir(genome_dir)))
+            cmnd = f"parsnp -d {genome_dir} -r {reference} -o {output} -p {threads}"
+            with profiling.stage('parsnp'):
+                profiling.call(cmnd.split())
 
         path2xmfa = os.path.join(output, 'parsnp.xmfa')
         cmnd2 = f"harvesttools -x {path2xmfa} -M " + os.path.join(output_dir,'parsnp.mfa')
-        subprocess.call(cmnd2.split())
+        with profiling.stage('harvesttools'):
+            profiling.call(cmnd2.split())
 
 class FastaRecord:
     """
@@ -58,45 +107,153 @@ class FastaRecord:
             raise TypeError('ID should be a string, integer, or float.')
         self.id = identifier
 
+def _scan_fasta(handle):
+    """
+    Yields (name, sequence start, sequence end, sequence lines) for each record
+    of a FASTA file opened in binary mode, in one pass and holding only one
+    record in memory. Start and end are byte offsets into the file.
+    """
+    name, start, lines = None, 0, []
+    offset = 0
+    for line in iter(handle.readline, b''):
+        stripped = line.strip()
+        if stripped.startswith(b'>'):
+            if name is not None:
+                yield name, start, offset, lines
+            name, start, lines = stripped[1:], offset + len(line), []
+        elif name is not None:
+            lines.append(stripped)
+        offset += len(line)
+    if name is not None:
+        yield name, start, offset, lines
+
+def _kept_columns(length, columns, masks):
+    """
+    Returns the indices of the columns compared when grouping sequences of a given length.
+    """
+    keep = np.zeros(length, dtype=bool)
+    if columns is None:
+        keep[:] = True
+    else:
+        columns = np.asarray(list(columns), dtype=np.int64)
+        keep[columns[columns < length]] = True
+    if masks is not None:
+        keep &= ~masks.contains(np.arange(1, length + 1))
+    return np.flatnonzero(keep)
+
 class MultiFastaParser:
     """
     Makes it easier to access data in a multi-FASTA file.
+
+    Records are read lazily: iterating over the parser yields FastaRecord objects
+    one at a time in a single pass over the file. With index=True, a byte-offset
+    index is built so records can be fetched by name with get(). With
+    use_mmap=True, the file is memory-mapped instead of read through a buffer.
     """
-    def __init__(self, multifasta):
+    def __init__(self, multifasta, index=False, use_mmap=False):
         if os.path.isfile(multifasta):
             self.fasta = multifasta
         else:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), multifasta)
-        
-        self.records = []
-
-        # Populates self.records with FastaRecord objects
-        with open(self.fasta, 'r') as f:
-            lines = [line.strip() for line in f.readlines()]
-            length = len(lines)
-            for i in range(0, length - 1):
-                if lines[i][0] == '>':
-                    j = 1
-                    while i+j < length:
-                        if lines[i+j][0] == '>':
-                            break
-                        j += 1
-                    consensus = ''.join(line for line in lines[i+1:i+j])
-                    name = lines[i][1:]
-                    self.records.append(FastaRecord(name, consensus))
-
-    def get_groups(self):
+
+        self.use_mmap = use_mmap
+        self._records = None
+        self._index = None
+        if index:
+            self.build_index()
+
+    @contextmanager
+    def _open(self):
+        with open(self.fasta, 'rb') as f:
+            if self.use_mmap and os.path.getsize(self.fasta):
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    yield mapped
+            else:
+                yield f
+
+    def _scan(self):
+        with self._open() as handle:
+            yield from _scan_fasta(handle)
+
+    def __iter__(self):
+        for name, _, _, lines in self._scan():
+            yield FastaRecord(name.decode(), b''.join(lines).decode())
+
+    @property
+    def records(self):
+        """
+        List of every FastaRecord in the file, read on first access.
+        """
+        if self._records is None:
+            self._records = list(self)
+        return self._records
+
+    def first(self):
+        """
+        Returns the first record without reading the rest of the file.
+        """
+        return next(iter(self), None)
+
+    @profiled(records=len)
+    def build_index(self):
+        """
+        Records the byte offsets of each record's sequence, keyed by record name.
+        """
+        self._index = dict()
+        for name, start, end, _ in self._scan():
+            self._index.setdefault(name.decode(), (start, end))
+        return self._index
+
+    def names(self):
+        """
+        Returns the names of all records in file order.
+        """
+        if self._index is not None:
+            return list(self._index)
+        return [name.decode() for name, _, _, _ in self._scan()]
+
+    def get(self, name):
+        """
+        Returns the FastaRecord with the given name, seeking straight to it.
+        """
+        if self._index is None:
+            self.build_index()
+        start, end = self._index[name]
+        with self._open() as handle:
+            handle.seek(start)
+            data = handle.read(end - start)
+        return FastaRecord(name, data.translate(None, b' \t\r\n').decode())
+
+    @profiled(records=lambda groups: sum(len(group) for group in groups))
+    def get_groups(self, columns=None, masks=None):
         """
         Method that parses multi-FASTA file and groups records by sequence in dictionary.
+
+        Records are compared by a blake2b digest of their sequence, so memory use
+        does not grow with the size of the alignment. Passing columns (0-based
+        column indices) compares only those columns; passing masks (a mask file
+        or Mask of 1-based columns) ignores the masked columns.
         """
+        if masks is not None and not isinstance(masks, Mask):
+            masks = load_mask(masks)
+        restricted = columns is not None or masks is not None
+        keep_by_length = dict() # columns compared, per sequence length
+
         groups = dict()
-        for record in self.records:
-            if record.seq in groups:
-                groups[record.seq].add(record.name)
+        for name, _, _, lines in self._scan():
+            digest = hashlib.blake2b()
+            if restricted:
+                seq = np.frombuffer(b''.join(lines), dtype=np.uint8)
+                if len(seq) not in keep_by_length:
+                    keep_by_length[len(seq)] = _kept_columns(len(seq), columns, masks)
+                digest.update(seq[keep_by_length[len(seq)]].tobytes())
             else:
-                groups[record.seq] = {record.name}
+                for line in lines:
+                    digest.update(line)
+            groups.setdefault(digest.digest(), set()).add(name.decode())
         return list(groups.values())
 
+    @profiled()
     def infer_phylogeny(self, output_dir='', label='tree', threads=THREADS, custom_cmd=''):
         """
         Runs RAxML on the multi-fasta file and stores output in output_dir.
@@ -119,10 +276,28 @@ class MultiFastaParser:
             path = os.path.join(cwd, self.fasta)
             cmnd = f"raxmlHPC -s {path} -w {os.path.join(cwd, output_dir)} \
                 -n {label} -m GTRGAMMA -p {threads}"
-        subprocess.call(cmnd.split())
+        profiling.call(cmnd.split())
 
         # Print out when finished
         msg = f'Ran RAxML on {self.fasta} and stored files in directory: {output_dir}' + '.'
         print(msg)
 
+    @profiled()
+    def neighbor_joining(self, output=''):
+        """
+        Builds a neighbor-joining tree of SNP distances between the records in-process,
+        without RAxML. Records should all have the same length, e.g. consensus
+        sequences built on one reference.
+
+        Returns the tree as a Newick string and also writes it to output if given.
+        """
+        from transmission_toolkit.phylo import snp_tree # phylo depends on this module
+
+        records = self.records
+        newick = snp_tree([record.name for record in records], records)
+        if output:
+            with open(output, 'w') as f:
+                f.write(newick + '\n')
+        return newick
+
 
@@ -1,47 +1,251 @@
 """Module for extracting data from VCF files"""
 import os
 import glob
-import vcf
-from transmission_toolkit.utils import get_seq
-
-def _is_lfv(min_AF, max_AF, var_reads, total_reads):
-    freq = var_reads / total_reads
-    if min_AF <= freq < max_AF:
-        return True
-    return False
-
-def _biallelic_store(var_dict, pos, var, freq, var_depth):
-    if pos in var_dict:
-        variant = list(var_dict[pos].values())
-        old_freq = variant[0][0]
-        if old_freq < freq:
-            var_dict[pos] = {var: [freq, var_depth]}
-    else:
-        var_dict[pos] = {var: [freq, var_depth]}
-
-def _multiallelic_store(var_dict, pos, var, freq, var_depth):
-        if pos in var_dict:
-            var_dict[pos][var] = [freq, var_depth]
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+import functools
+import itertools
+import numpy as np
+from transmission_toolkit.masks import load_mask
+from transmission_toolkit.profiling import profiled
+from transmission_toolkit.tabix import fetch, index_path, open_text
+from transmission_toolkit.utils import getpathleaf, list_vcfs, load_reference
+from transmission_toolkit.variants import VariantTable
+
+# INFO fields a VCF must declare for the fast lofreq reader to be used
+LOFREQ_INFO = ('DP', 'DP4')
+VCF_CACHE_SIZE = 4096 # Number of parsed VCF files kept in memory
+CACHE_ENV = 'TRANSMISSION_TOOLKIT_CACHE' # Enables the on-disk cache in this directory
+CACHE_VERSION = 3 # Bump whenever the layout of cached tables changes
+VALIDATION_TYPES = {'mtime', 'hash'}
+
+# Settings of the on-disk cache of parsed VCFs, see set_cache_dir
+_disk_cache = {'dir': os.environ.get(CACHE_ENV) or None, 'validate': 'mtime'}
+
+def _is_lofreq(header):
+    """
+    Checks whether the meta-information lines declare the lofreq INFO fields.
+    """
+    declared = set()
+    for line in header:
+        if line.startswith('##INFO=<ID='):
+            declared.add(line[len('##INFO=<ID='):].split(',', 1)[0])
+    return all(field in declared for field in LOFREQ_INFO)
+
+def _lofreq_records(lines):
+    """
+    Splits out POS, REF, ALT, DP, DP4, FILTER and INDEL from the data lines of a lofreq VCF.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        fields = line.rstrip('\r\n').split('\t', 8)
+        info = {}
+        indel = False
+        for item in fields[7].split(';'):
+            if item.startswith('DP'):
+                key, _, value = item.partition('=')
+                info[key] = value
+            elif item == 'INDEL':
+                indel = True
+        raw_depth = int(info['DP'])
+        dp4 = [int(count) for count in info['DP4'].split(',')]
+        alt = fields[4].split(',', 1)[0]
+        indel = indel or len(fields[3]) != len(alt)
+        yield int(fields[1]), fields[3][0], alt, raw_depth, dp4, fields[6] == 'PASS', indel
+
+def _integers(value, count, field):
+    """
+    Converts an INFO value read by PyVCF to a list of count integers. Fields the
+    header does not declare come back as lists of strings.
+    """
+    values = value if isinstance(value, (list, tuple)) else [value]
+    if len(values) != count:
+        raise ValueError(f'Expected {count} values in INFO field {field}, got {len(values)}.')
+    return [int(item) for item in values]
+
+def _pyvcf_records(lines):
+    """
+    Reads POS, REF, ALT, DP, DP4, FILTER and INDEL from the lines of any VCF using PyVCF.
+    """
+    import vcf # only needed for VCFs the lofreq reader cannot read
+
+    for record in vcf.Reader(lines):
+        alt = str(record.ALT[0])
+        indel = bool(record.INFO.get('INDEL')) or len(record.REF) != len(alt)
+        raw_depth = _integers(record.INFO['DP'], 1, 'DP')[0]
+        dp4 = _integers(record.INFO['DP4'], 4, 'DP4')
+        yield record.POS, str(record.REF[0]), alt, raw_depth, dp4, record.FILTER == [], indel
+
+def read_records(vcf_file, region=None):
+    """
+    Yields (position, ref, alt, raw depth, DP4, passed FILTER, is INDEL) for
+    every record in a plain or bgzip-compressed VCF file.
+
+    Lofreq-style VCFs are scanned line by line, other VCFs are read with PyVCF.
+    If region (start, end) is given, only records with start <= position <= end
+    are yielded, and a compressed VCF with a tabix index is read from the blocks
+    covering the region only.
+    """
+    with open_text(vcf_file) as f:
+        header = []
+        for line in f:
+            header.append(line)
+            if not line.startswith('##'):
+                break
+
+        lines = f
+        if region is not None and index_path(vcf_file):
+            lines = fetch(vcf_file, region[0] - 1, region[1])
+        if _is_lofreq(header):
+            records = _lofreq_records(lines)
         else:
-            var_dict[pos] = {var: [freq, var_depth]}
+            records = _pyvcf_records(itertools.chain(header, lines))
+
+        if region is None:
+            yield from records
+            return
+        for record in records:
+            if region[0] <= record[0] <= region[1]:
+                yield record
+
+def set_cache_dir(cache_dir, validate='mtime'):
+    """
+    Stores parsed VCFs under cache_dir so later sessions can skip parsing them.
+
+    Cached tables are checked against the VCF's modification time and size, or
+    against a hash of its contents if validate is 'hash'. Passing None as
+    cache_dir turns the on-disk cache off.
+    """
+    if validate not in VALIDATION_TYPES:
+        raise ValueError("Invalid input.")
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    _disk_cache.update(dir=cache_dir, validate=validate)
+
+def _file_hash(path):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _stamp(path, mtime, size):
+    """
+    Returns what a cached table must match to be reused for the given VCF.
+    """
+    stamp = {'version': CACHE_VERSION, 'path': path, 'mtime': mtime, 'size': size}
+    if _disk_cache['validate'] == 'hash':
+        stamp = {'version': CACHE_VERSION, 'path': path, 'hash': _file_hash(path)}
+    return stamp
+
+def _disk_variants(path, mtime, size):
+    """
+    Loads a VCF's table from the on-disk cache, parsing and caching it if needed.
+    """
+    name = hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+    entry = os.path.join(_disk_cache['dir'], name)
+    stamp = _stamp(path, mtime, size)
+
+    try:
+        with open(os.path.join(entry, 'stamp.json'), 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+    if all(cached.get(key) == value for key, value in stamp.items()):
+        return VariantTable.load(entry)
+
+    table = VariantTable.from_records(read_records(path))
+
+    # Write to a temporary directory first so readers never see half an entry
+    tmp = tempfile.mkdtemp(dir=_disk_cache['dir'])
+    try:
+        table.save(tmp)
+        with open(os.path.join(tmp, 'stamp.json'), 'w') as f:
+            json.dump(stamp, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return table
+
+@functools.lru_cache(maxsize=VCF_CACHE_SIZE)
+def _cached_variants(path, mtime, size, region=None):
+    if region is not None:
+        return VariantTable.from_records(read_records(path, region))
+    if _disk_cache['dir']:
+        return _disk_variants(path, mtime, size)
+    return VariantTable.from_records(read_records(path))
+
+def load_variants(vcf_file, region=None):
+    """
+    Returns every record of a VCF file as a VariantTable.
+
+    Each file is parsed once per session and then served from memory until its
+    modification time or size changes. If set_cache_dir was called, tables are
+    also memory-mapped from the on-disk cache. The returned table is read-only.
+
+    If region (start, end) is given, only records with start <= position <= end
+    are returned. For bgzip-compressed VCFs with a tabix index only that region
+    is read, otherwise it is cut out of the whole file's table.
+    """
+    path = os.path.realpath(vcf_file)
+    stat = os.stat(path)
+    if region is None:
+        return _cached_variants(path, stat.st_mtime_ns, stat.st_size)
+    region = (int(region[0]), int(region[1]))
+    if index_path(path):
+        return _cached_variants(path, stat.st_mtime_ns, stat.st_size, region)
+    return _cached_variants(path, stat.st_mtime_ns, stat.st_size).region(*region)
+
+@profiled(records=len)
+def load_variant_tables(vcf_files, region=None):
+    """
+    Loads a directory (or list) of VCF files and returns {sample name: VariantTable},
+    where the sample name is the file name up to the first '.'.
+
+    Index files in the directory are skipped. See load_variants for region.
+    """
+    if isinstance(vcf_files, (str, os.PathLike)):
+        vcf_files = list_vcfs(vcf_files)
+    return {getpathleaf(path).split('.')[0]: load_variants(path, region) for path in vcf_files}
+
+def clear_cache():
+    """
+    Drops all VCF files parsed by load_variants from memory.
+    """
+    _cached_variants.cache_clear()
+
+def warm_cache(vcf_dir, cache_dir=None, validate='mtime'):
+    """
+    Parses every VCF in vcf_dir into the on-disk cache and returns their paths.
+    """
+    if cache_dir:
+        set_cache_dir(cache_dir, validate=validate)
+    if not _disk_cache['dir']:
+        raise ValueError("No cache directory set.")
+
+    cached = []
+    for vcf_path in list_vcfs(vcf_dir):
+        path = os.path.realpath(vcf_path)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            _disk_variants(path, stat.st_mtime_ns, stat.st_size)
+            cached.append(path)
+    return cached
 
 def mask_parse(masks):
     """
-    Parses a txt file of masked positions
-    """
-    mask_positions = []
-    with open(masks, "r") as mask_file:
-            for line in mask_file:
-                comma_split = line.split(",")
-                for item in comma_split:
-                    nums = item.split("-")
-                    if len(nums) == 1:
-                        mask_positions.append(int(nums[0]))
-                    else:
-                        for num in range(int(nums[0]), int(nums[1])):
-                            mask_positions.append(int(num))
-    return mask_positions
+    Parses a txt file of masked positions and returns them as a sorted list.
+
+    Use load_mask for membership tests, which keeps the positions as intervals.
+    """
+    return load_mask(masks).positions().tolist()
 
+@profiled(records=len)
 def extract_lfv(
     vcf_file, 
     min_AF=1, 
@@ -49,11 +253,24 @@ def extract_lfv(
     parse_type='biallelic', 
     store_ref=True, 
     masks=None, 
-    mask_status='hide'
+    mask_status='hide',
+    min_read_depth=0,
+    min_strand_depth=0,
+    pass_only=False,
+    exclude_indels=False,
+    region=None
     ):
     """
     Extracts variant data from VCF and creates a dictionary storing data
     in the form: {position: {variant: [frequency, depth]}}.
+
+    The VCF can be bgzip-compressed. If region (start, end) is given, only
+    positions from start to end are kept, reading just that region when the
+    VCF has a tabix index.
+
+    Records with a raw depth (DP) below min_read_depth, fewer than
+    min_strand_depth ALT reads on either strand, a FILTER other than PASS (if
+    pass_only) or that are INDELs (if exclude_indels) are skipped.
     """
 
     #### Handle Errors #####
@@ -61,51 +278,25 @@ def extract_lfv(
     MASK_TYPES = {"hide", "highlight"}
     if min_AF < 0 or max_AF > 1 or parse_type not in PARSE_TYPES or mask_status not in MASK_TYPES:
         raise ValueError("Invalid input.")
+    if min_read_depth < 0 or min_strand_depth < 0:
+        raise ValueError("Invalid input.")
     #########################
 
     #Parse mask file if mask file is inputted
-    if masks != None:
-        mask_positions = mask_parse(masks)
-
-    lfv_data, ref_data = {}, {}
-    data = vcf.Reader(open(vcf_file, 'r'))
-
-    for record in data:
+    mask = load_mask(masks) if masks != None else None
 
-        var_depth = record.INFO['DP4'][2] + record.INFO['DP4'][3] # Num of variant reads
-        raw_depth = record.INFO['DP'] # Num of total reads
-        pos, var, freq = record.POS, str(record.ALT[0]), float(var_depth / raw_depth) 
-
-        #doesn't include masked positions based on user settings
-        if masks!= None and pos in mask_positions and mask_status == 'hide':
-            continue
-
-        # If variant passes restrictions, store data
-        if _is_lfv(min_AF, max_AF, var_depth, raw_depth):
-            if parse_type == 'biallelic':
-                _biallelic_store(lfv_data, pos, var, freq, var_depth)
-            else:
-                _multiallelic_store(lfv_data, pos, var, freq, var_depth)
-
-        if store_ref and not pos in ref_data:
-
-            # Get reference data
-            ref_depth = record.INFO['DP4'][0] + record.INFO['DP4'][1]
-            ref = str(record.REF[0])
-            
-            # If ref allele passes restrictions, store the data
-            if _is_lfv(min_AF, max_AF, ref_depth, raw_depth):
-                ref_data[pos] = {ref: [(ref_depth / raw_depth), ref_depth]}
-
-    # If we collected reference data, update lfv_data
-    if ref_data:
-        for pos in ref_data:
-            if not pos in lfv_data:
-                lfv_data[pos] = ref_data[pos]
-            else:
-                lfv_data[pos].update(ref_data[pos])
-
-    return lfv_data
+    return load_variants(vcf_file, region).to_dict(
+        min_AF=min_AF,
+        max_AF=max_AF,
+        parse_type=parse_type,
+        store_ref=store_ref,
+        masks=mask,
+        mask_status=mask_status,
+        min_read_depth=min_read_depth,
+        min_strand_depth=min_strand_depth,
+        pass_only=pass_only,
+        exclude_indels=exclude_indels
+    )
 
 def build_majority_consensus(
     vcf_file, 
@@ -116,34 +307,40 @@ def build_majority_consensus(
     """
     With a reference file specified, builds consensus sequence.
     """
-    
-    consensus = list(get_seq(reference))
-    variants = extract_lfv(
-        vcf_file, 
-        min_AF=0, 
-        max_AF=1, 
-        parse_type='biallelic', 
-        store_ref=True, 
-        masks=None, 
-        mask_status='hide'
-    )
+    return _majority_consensus(vcf_file, load_reference(reference))
 
-    highest_variants = {}
+def _patch_reference(reference, alleles):
+    """
+    Returns a copy of the reference as a string with the base at each position
+    replaced by the allele in alleles ({position: allele}).
+    """
+    if all(len(allele) == 1 for allele in alleles.values()):
+        consensus = np.array(reference, dtype=np.uint8)
+        positions = np.fromiter(alleles.keys(), dtype=np.int64, count=len(alleles))
+        consensus[positions - 1] = np.frombuffer(''.join(alleles.values()).encode('ascii'), dtype=np.uint8)
+        return consensus.tobytes().decode('ascii')
 
-    for pos in variants:
-        highest_freq = 0
-        kept_var = None
-        for var in variants[pos]:
-            if variants[pos][var][0] > highest_freq:
-                highest_freq = variants[pos][var][0]
-                kept_var = var
-        if kept_var:
-            highest_variants[pos] = str(kept_var)
+    # Alleles longer than one base shift everything after them, so splice instead
+    if alleles and max(alleles) > len(reference):
+        raise IndexError('list assignment index out of range')
+    reference = np.asarray(reference).tobytes().decode('ascii')
+    pieces, prev = [], 0
+    for pos in sorted(alleles):
+        pieces.append(reference[prev:pos - 1])
+        pieces.append(alleles[pos])
+        prev = pos
+    pieces.append(reference[prev:])
+    return ''.join(pieces)
 
-    for pos in highest_variants:
-        consensus[pos - 1] = highest_variants[pos]
+def _majority_consensus(vcf_file, reference):
+    """
+    Builds the majority consensus of a VCF file on a reference loaded with load_reference.
+    """
+    table = load_variants(vcf_file)
+    positions, alleles = table.majority_alleles()
+    highest_variants = {pos: table.alleles[allele] for pos, allele in zip(positions.tolist(), alleles.tolist())}
 
-    return ''.join(consensus)
+    return _patch_reference(reference, highest_variants)
 
 def build_minor_consensus(
     vcf_file, 
@@ -156,33 +353,31 @@ def build_minor_consensus(
     """
     Builds consensus with variants that have second highest frequency.
     """
-    consensus = list(get_seq(reference))
-    data = extract_lfv(
-        vcf_file, 
-        min_AF=min_AF, 
-        max_AF=max_AF, 
-        parse_type='multiallelic', 
-        store_ref=True, 
-        masks=None, 
-        mask_status='hide'
-    )
+    return _minor_consensus(vcf_file, load_reference(reference), min_AF=min_AF, max_AF=max_AF)
 
-    variants = {}
+def _minor_consensus(vcf_file, reference, min_AF=0, max_AF=1):
+    """
+    Builds the minor consensus of a VCF file on a reference loaded with load_reference.
+    """
+    table = load_variants(vcf_file)
+    positions, alleles = table.minor_alleles(min_AF=min_AF, max_AF=max_AF)
+    variants = {pos: table.alleles[allele] for pos, allele in zip(positions.tolist(), alleles.tolist())}
 
-    for pos in data:
-        highest_freq = 0
-        max_freq = max([data[pos][var][0] for var in data[pos]])
-        kept_var = None
-        for var in data[pos]:
-            freq = data[pos][var][0]
-            if freq > highest_freq and freq != max_freq:
-                highest_freq = data[pos][var][0]
-                kept_var = var
-        if kept_var:
-            variants[pos] = str(kept_var)
+    return _patch_reference(reference, variants)
 
-    for pos in variants:
-        consensus[pos - 1] = variants[pos]
+def main(argv=None):
+    """
+    Command line entry point for pre-warming the on-disk VCF cache.
+    """
+    parser = argparse.ArgumentParser(description='Parses a directory of VCF files into the on-disk cache.')
+    parser.add_argument('vcf_dir', help='directory of VCF files')
+    parser.add_argument('cache_dir', help='directory to store parsed VCF files in')
+    parser.add_argument('--validate', choices=sorted(VALIDATION_TYPES), default='mtime',
+                        help='how cached files are checked against their VCF')
+    args = parser.parse_args(argv)
 
-    return ''.join(consensus)
+    cached = warm_cache(args.vcf_dir, args.cache_dir, validate=args.validate)
+    print(f'Cached {len(cached)} VCF files in {args.cache_dir}.')
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Module containing a sparse matrix of variant frequencies across many samples"""
+import json
+
+import numpy as np
+
+from transmission_toolkit.masks import load_mask
+from transmission_toolkit.VCFtools import load_variant_tables
+
+class CohortMatrix:
+    """
+    Sparse (samples x variants) matrix of allele frequencies and depths.
+
+    Rows are samples and columns are (position, allele) pairs sorted by position
+    and allele. Entries are stored in compressed sparse row form: the entries of
+    row i are indices[indptr[i]:indptr[i+1]], with matching freq and depth.
+    """
+    def __init__(self, samples, positions, alleles, indptr, indices, freq, depth, params=None):
+        self.samples = list(samples)
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.alleles = np.asarray(alleles, dtype=str)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.freq = np.asarray(freq, dtype=np.float64)
+        self.depth = np.asarray(depth, dtype=np.int64)
+        self.params = dict(params or {})
+        self.sample_index = {name: i for i, name in enumerate(self.samples)}
+
+    @classmethod
+    def from_vcfs(
+        cls,
+        vcf_files,
+        min_AF=0,
+        max_AF=1,
+        parse_type='multiallelic',
+        store_ref=False,
+        masks=None,
+        mask_status='hide',
+        min_read_depth=0,
+        min_strand_depth=0,
+        pass_only=False,
+        exclude_indels=False
+        ):
+        """
+        Builds the matrix from a directory (or list) of VCF files, filtering each
+        sample as extract_lfv would with the same arguments.
+        """
+        tables = load_variant_tables(vcf_files)
+        mask = load_mask(masks) if masks is not None else None
+        params = dict(min_AF=min_AF, max_AF=max_AF, parse_type=parse_type,
+                      store_ref=store_ref, mask_status=mask_status,
+                      min_read_depth=min_read_depth, min_strand_depth=min_strand_depth,
+                      pass_only=pass_only, exclude_indels=exclude_indels)
+
+        samples = sorted(tables)
+        allele_codes = dict()
+        rows, positions, codes, freqs, depths = [], [], [], [], []
+        for i, name in enumerate(samples):
+            table = tables[name]
+            reduced = table.reduce(masks=mask, **params)
+            local = np.array(
+                [allele_codes.setdefault(allele, len(allele_codes)) for allele in table.alleles],
+                dtype=np.int64
+            )
+            rows.append(np.full(len(reduced.pos), i, dtype=np.int64))
+            positions.append(reduced.pos)
+            codes.append(local[reduced.allele])
+            freqs.append(reduced.freq)
+            depths.append(reduced.depth)
+
+        # Number alleles alphabetically so columns sort by (position, allele)
+        alleles = sorted(allele_codes)
+        remap = np.empty(len(alleles), dtype=np.int64)
+        remap[[allele_codes[allele] for allele in alleles]] = np.arange(len(alleles))
+
+        # Each distinct (position, allele) key becomes a column
+        width = max(len(alleles), 1)
+        rows = _concat(rows, np.int64)
+        keys = _concat(positions, np.int64) * width + remap[_concat(codes, np.int64)]
+        columns, indices = np.unique(keys, return_inverse=True)
+        order = np.lexsort((indices, rows))
+
+        params['masks'] = masks
+        return cls(
+            samples,
+            columns // width,
+            np.array(alleles, dtype=str)[columns % width] if alleles else [],
+            np.searchsorted(rows[order], np.arange(len(samples) + 1)),
+            indices[order],
+            _concat(freqs, np.float64)[order],
+            _concat(depths, np.int64)[order],
+            params
+        )
+
+    @property
+    def shape(self):
+        return len(self.samples), len(self.positions)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _row_slice(self, sample):
+        i = self.sample_index[sample]
+        return slice(self.indptr[i], self.indptr[i + 1])
+
+    def row(self, sample):
+        """
+        Returns (column indices, frequencies, depths) of one sample's variants.
+        """
+        span = self._row_slice(sample)
+        return self.indices[span], self.freq[span], self.depth[span]
+
+    def variants(self, sample):
+        """
+        Returns one sample's variants as {(position, allele): [frequency, depth]}.
+        """
+        cols, freq, depth = self.row(sample)
+        return {
+            (pos, allele): [f, d] for pos, allele, f, d in zip(
+                self.positions[cols].tolist(), self.alleles[cols].tolist(), freq.tolist(), depth.tolist()
+            )
+        }
+
+    def to_dict(self, sample):
+        """
+        Returns one sample's variants in the form: {position: {variant: [frequency, depth]}}.
+        """
+        data = {}
+        for (pos, allele), value in self.variants(sample).items():
+            data.setdefault(pos, {})[allele] = value
+        return data
+
+    def select(self, samples=None, position_range=None, min_AF=None, max_AF=None):
+        """
+        Returns a new CohortMatrix restricted to a subset of samples, to columns
+        with positions in position_range (inclusive) and to entries with
+        frequencies in [min_AF, max_AF).
+        """
+        samples = self.samples if samples is None else list(samples)
+        rows = np.array([self.sample_index[name] for name in samples], dtype=np.int64)
+
+        keep_cols = np.ones(len(self.positions), dtype=bool)
+        if position_range:
+            keep_cols &= (position_range[0] <= self.positions) & (self.positions <= position_range[1])
+        new_col = np.cumsum(keep_cols) - 1
+
+        # Gather the entries of the selected rows in their new order
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        lengths = ends - starts
+        entry = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        entry_row = np.repeat(np.arange(len(rows)), lengths)
+
+        keep = keep_cols[self.indices[entry]]
+        if min_AF is not None:
+            keep &= self.freq[entry] >= min_AF
+        if max_AF is not None:
+            keep &= self.freq[entry] < max_AF
+        entry, entry_row = entry[keep], entry_row[keep]
+
+        return CohortMatrix(
+            samples,
+            self.positions[keep_cols],
+            self.alleles[keep_cols],
+            np.searchsorted(entry_row, np.arange(len(samples) + 1)),
+            new_col[self.indices[entry]],
+            self.freq[entry],
+            self.depth[entry],
+            self.params
+        )
+
+    def dense(self, values='freq'):
+        """
+        Returns the matrix as a dense array of 'freq' or 'depth' values.
+        """
+        data = getattr(self, values)
+        matrix = np.zeros(self.shape, dtype=data.dtype)
+        matrix[np.repeat(np.arange(len(self)), np.diff(self.indptr)), self.indices] = data
+        return matrix
+
+    def to_scipy(self, values='freq'):
+        """
+        Returns the matrix as a scipy.sparse.csr_matrix of 'freq' or 'depth' values.
+        """
+        from scipy.sparse import csr_matrix
+        return csr_matrix((getattr(self, values), self.indices, self.indptr), shape=self.shape)
+
+    def save(self, path):
+        """
+        Writes the matrix to a .npz file.
+        """
+        np.savez(
+            path,
+            samples=np.array(self.samples, dtype=str),
+            positions=self.positions,
+            alleles=self.alleles,
+            indptr=self.indptr,
+            indices=self.indices,
+            freq=self.freq,
+            depth=self.depth,
+            params=np.array(json.dumps(self.params))
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a matrix written by CohortMatrix.save.
+        """
+        with np.load(path) as data:
+            params = json.loads(str(data['params']))
+            return cls(
+                data['samples'].tolist(),
+                data['positions'],
+                data['alleles'],
+                data['indptr'],
+                data['indices'],
+                data['freq'],
+                data['depth'],
+                params
+            )
+
+def _concat(arrays, dtype):
+    return np.concatenate(arrays) if arrays else np.array([], dtype=dtype)
@@ -0,0 +1,147 @@
+"""Module for building the consensus sequences of many VCF files at once"""
+import os
+import hashlib
+
+import numpy as np
+
+from transmission_toolkit.convertFile import LINE_WRAP
+from transmission_toolkit.FASTAtools import FastaRecord
+from transmission_toolkit.utils import getpathleaf, list_vcfs, load_reference
+from transmission_toolkit.VCFtools import load_variants, _patch_reference
+
+CONSENSUS_TYPES = {'majority', 'minor'}
+
+class ConsensusMatrix:
+    """
+    Consensus sequences of several samples stored as a (samples x genome length)
+    uint8 matrix, one row per sample.
+
+    Rows stay aligned to the reference, so they only hold the first base of
+    alleles longer than one base. The full sequences of those samples are kept
+    in spliced ({name: sequence}) and used when writing or returning sequences.
+    """
+    def __init__(self, names, matrix, spliced=None):
+        if len(names) != len(matrix):
+            raise ValueError('There should be one name per row of the matrix.')
+        self.names = list(names)
+        self.matrix = matrix
+        self.spliced = spliced or {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def sequence(self, idx):
+        """
+        Returns the consensus of row idx as a string.
+        """
+        if self.names[idx] in self.spliced:
+            return self.spliced[self.names[idx]]
+        return self.matrix[idx].tobytes().decode('ascii')
+
+    def records(self):
+        """
+        Returns a FastaRecord for every sample.
+        """
+        return [FastaRecord(name, self.sequence(i)) for i, name in enumerate(self.names)]
+
+    def _fasta_lines(self, idx, line_length):
+        if self.names[idx] in self.spliced:
+            row = self.spliced[self.names[idx]].encode('ascii')
+        else:
+            row = self.matrix[idx].tobytes()
+        yield b'>' + self.names[idx].encode() + b'\n'
+        for i in range(0, len(row), line_length):
+            yield row[i: i+line_length] + b'\n'
+
+    def write_multifasta(self, path, line_length=LINE_WRAP):
+        """
+        Writes every consensus to one multi-FASTA file.
+        """
+        with open(path, 'wb') as f:
+            f.write(b''.join(
+                line for idx in range(len(self)) for line in self._fasta_lines(idx, line_length)
+            ))
+
+    def write_fastas(self, output_dir="", line_length=LINE_WRAP):
+        """
+        Writes each consensus to its own .fna file, as vcf2fasta does, and
+        returns the paths written.
+        """
+        if output_dir and not os.path.exists(output_dir):
+            os.mkdir(output_dir)
+        paths = []
+        for idx, name in enumerate(self.names):
+            path = os.path.join(output_dir, name + '.fna')
+            with open(path, 'wb') as f:
+                f.write(b''.join(self._fasta_lines(idx, line_length)))
+            paths.append(path)
+        return paths
+
+    def get_groups(self):
+        """
+        Groups samples with identical consensus sequences, like MultiFastaParser.get_groups.
+        """
+        groups = dict()
+        for idx, name in enumerate(self.names):
+            digest = hashlib.blake2b(self.sequence(idx).encode('ascii')).digest()
+            groups.setdefault(digest, set()).add(name)
+        return list(groups.values())
+
+def build_consensus_matrix(
+    vcf_files,
+    reference,
+    consensus_type='majority',
+    min_AF=0,
+    max_AF=1,
+    reference_name=None,
+    errors=None
+    ):
+    """
+    Builds the consensus of every VCF file (a directory or a list of paths) on
+    one reference and returns them as a ConsensusMatrix.
+
+    Every row starts as a copy of the reference and all chosen alleles are
+    written with a single scatter. Only the first base of a multi-base allele
+    is placed in the matrix; the full sequence of such samples is spliced as
+    vcf2fasta does and kept in ConsensusMatrix.spliced.
+    min_AF and max_AF only apply to the minor consensus, as in build_minor_consensus.
+
+    With reference_name, the reference itself is the first row, under that name.
+    If errors is a dictionary, files that cannot be read are skipped and their
+    error messages stored in it by path; otherwise the first error is raised.
+    """
+    if consensus_type not in CONSENSUS_TYPES:
+        raise ValueError(f'Unexpected consensus_type: {consensus_type}.')
+    if isinstance(vcf_files, str):
+        vcf_files = list_vcfs(vcf_files)
+
+    ref = load_reference(reference)
+    names = [] if reference_name is None else [reference_name]
+    rows, cols, codes, spliced = [], [], [], {}
+    for vcf_file in vcf_files:
+        try:
+            table = load_variants(vcf_file)
+        except Exception as err: # pylint: disable=broad-except
+            if errors is None:
+                raise
+            errors[vcf_file] = f'{type(err).__name__}: {err}'
+            continue
+        if consensus_type == 'majority':
+            positions, alleles = table.majority_alleles()
+        else:
+            positions, alleles = table.minor_alleles(min_AF=min_AF, max_AF=max_AF)
+        name = getpathleaf(vcf_file).split('.')[0]
+        first_base = np.array([ord(allele[0]) for allele in table.alleles], dtype=np.uint8)
+        rows.append(np.full(len(positions), len(names), dtype=np.int64))
+        cols.append(positions - 1)
+        codes.append(first_base[alleles])
+        if any(len(table.alleles[allele]) > 1 for allele in np.unique(alleles).tolist()):
+            variants = {pos: table.alleles[allele] for pos, allele in zip(positions.tolist(), alleles.tolist())}
+            spliced[name] = _patch_reference(ref, variants)
+        names.append(name)
+
+    matrix = np.empty((len(names), len(ref)), dtype=np.uint8)
+    matrix[:] = ref
+    if rows:
+        matrix[np.concatenate(rows), np.concatenate(cols)] = np.concatenate(codes)
+    return ConsensusMatrix(names, matrix, spliced)
@@ -2,12 +2,34 @@
 Module for converting file types using BioPython's SeqIO module
 """
 import os
-from Bio import AlignIO
-from transmission_toolkit.utils import getpathleaf
-from transmission_toolkit.VCFtools import build_majority_consensus, build_minor_consensus
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from transmission_toolkit.profiling import profiled
+from transmission_toolkit.utils import getpathleaf, list_vcfs, load_reference
+from transmission_toolkit.VCFtools import _majority_consensus, _minor_consensus
 
 LINE_WRAP = 80 # Max. length of each line in fasta file 
+CONSENSUS_TYPES = {'majority', 'minor'}
 
+def _write_consensus(vcf_path, reference, output_dir, line_length, consensus_type):
+    """
+    Builds the consensus of a VCF file on a loaded reference and writes it as FASTA.
+    """
+    name = getpathleaf(vcf_path).split('.')[0]
+    path = os.path.join(output_dir, name + '.fna')
+    if consensus_type == 'majority':
+        seq = _majority_consensus(vcf_path, reference)
+    elif consensus_type == 'minor':
+        seq = _minor_consensus(vcf_path, reference, min_AF=0, max_AF=1)
+    else:
+        raise ValueError(f'Unexpected consensus_type: {consensus_type}.')
+
+    lines = [f'>{name}'] + [seq[i: i+line_length] for i in range(0, len(seq), line_length)]
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+@profiled(records=lambda path: 1)
 def vcf2fasta(
     vcf_path, 
     reference, 
@@ -30,36 +52,83 @@ def vcf2fasta(
         if not os.path.exists(output_dir):
             os.mkdir(output_dir)
 
-    name = getpathleaf(vcf_path).split('.')[0]
-    path = os.path.join(output_dir, name + '.fna')
-    if consensus_type == 'majority':
-        seq = build_majority_consensus(
-            vcf_path, 
-            reference, 
-            masks=None, 
-            mask_status='hide'
-        )
-    elif consensus_type == 'minor':
-        seq = build_minor_consensus(
-            vcf_path, 
-            reference, 
-            min_AF=0, 
-            max_AF=1, 
-            masks=None, 
-            mask_status='hide'
+    return _write_consensus(vcf_path, load_reference(reference), output_dir, line_length, consensus_type)
+
+# Reference sequence of the batch being converted, set once in each worker process
+_worker_reference = {}
+
+def _init_worker(ref_seq):
+    _worker_reference['seq'] = ref_seq
+
+def _batch_convert(vcf_path, output_dir, line_length, consensus_type):
+    """
+    Converts one file of a batch, returning the error message instead of raising.
+    """
+    try:
+        path = _write_consensus(
+            vcf_path,
+            _worker_reference['seq'],
+            output_dir,
+            line_length,
+            consensus_type
         )
-    else:
+        return vcf_path, path, None
+    except Exception as err: # pylint: disable=broad-except
+        return vcf_path, None, f'{type(err).__name__}: {err}'
+
+@profiled(records=lambda result: len(result[0]))
+def vcf2fasta_batch(
+    vcf_dir,
+    reference,
+    output_dir="",
+    line_length=LINE_WRAP,
+    consensus_type='majority',
+    workers=None
+    ):
+    """
+    Writes a FASTA file for every VCF file in a directory (or list of VCF paths),
+    converting files in parallel over a pool of worker processes.
+
+    The reference is read once and sent to each worker when it starts. A file
+    that fails to convert does not stop the batch. Returns (written, errors),
+    where written maps VCF paths to FASTA paths and errors maps VCF paths to
+    error messages.
+    """
+    if consensus_type not in CONSENSUS_TYPES:
         raise ValueError(f'Unexpected consensus_type: {consensus_type}.')
+    if isinstance(vcf_dir, str):
+        vcf_paths = list_vcfs(vcf_dir)
+    else:
+        vcf_paths = list(vcf_dir)
+    if output_dir and not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    ref_seq = load_reference(reference)
+    workers = min(workers or os.cpu_count() or 1, max(len(vcf_paths), 1))
+    args = (vcf_paths, repeat(output_dir), repeat(line_length), repeat(consensus_type))
+
+    if workers == 1:
+        _init_worker(ref_seq)
+        results = list(map(_batch_convert, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(ref_seq,)) as pool:
+            chunksize = max(len(vcf_paths) // (workers * 4), 1)
+            results = list(pool.map(_batch_convert, *args, chunksize=chunksize))
+
+    written, errors = {}, {}
+    for vcf_path, path, err in results:
+        if err is None:
+            written[vcf_path] = path
+        else:
+            errors[vcf_path] = err
+    return written, errors
 
-    with open(path, 'w') as f:
-        f.write(f'>{name}\n')
-        for i in range(0, len(seq), line_length):
-            f.write(seq[i: i+line_length] + '\n')
- 
 def convert_file(input_file, input_type, output_file, output_type):
     """
     Converts files using BioPython AlignIO module.
     """
+    from Bio import AlignIO
+
     with open(input_file, 'r') as f1, open(output_file, 'w') as f2:
         seq = AlignIO.parse(f1, input_type)
         AlignIO.write(seq, f2, output_type)
@@ -0,0 +1,164 @@
+"""Module for computing pairwise distances between aligned sequences"""
+import os
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from transmission_toolkit.masks import Mask, load_mask
+from transmission_toolkit.FASTAtools import MultiFastaParser
+
+BASES = b'ACGT' # Only these bases (in either case) are compared; N, gaps and ambiguity codes are skipped
+ROW_CHUNK = 512 # Rows of the distance matrix computed by each task
+COLUMN_CHUNK = 1024 # Alignment columns compared at a time
+
+def _base_codes():
+    codes = np.zeros(256, dtype=np.uint8)
+    for code, base in enumerate(BASES, 1):
+        codes[base] = code
+        codes[ord(chr(base).lower())] = code
+    return codes
+
+BASE_CODES = _base_codes() # Maps each byte to 1-4 for A, C, G and T and to 0 for anything else
+
+def sequence_matrix(sequences):
+    """
+    Stacks equal-length sequences (strings, FastaRecords or uint8 arrays such as
+    consensus arrays) into a (samples x length) uint8 matrix.
+    """
+    rows = []
+    for seq in sequences:
+        seq = getattr(seq, 'seq', seq)
+        if isinstance(seq, str):
+            seq = np.frombuffer(seq.encode('ascii'), dtype=np.uint8)
+        rows.append(np.asarray(seq, dtype=np.uint8))
+    if len({len(row) for row in rows}) > 1:
+        raise ValueError('Sequences should all have the same length.')
+    if not rows:
+        return np.zeros((0, 0), dtype=np.uint8)
+    return np.stack(rows)
+
+def fasta_matrix(multifasta):
+    """
+    Reads a multi-FASTA file (path or MultiFastaParser) of aligned records.
+    Returns (record names, (samples x length) uint8 matrix).
+    """
+    if not isinstance(multifasta, MultiFastaParser):
+        multifasta = MultiFastaParser(multifasta)
+    names, rows = [], []
+    for record in multifasta:
+        names.append(record.name)
+        rows.append(record.seq)
+    return names, sequence_matrix(rows)
+
+def _informative_columns(matrix, masks, column_chunk):
+    """
+    Returns the indices of the unmasked columns holding at least two different bases.
+    Every other column adds nothing to any distance.
+    """
+    length = matrix.shape[1]
+    keep = np.ones(length, dtype=bool)
+    if masks is not None:
+        keep &= ~masks.contains(np.arange(1, length + 1))
+    for start in range(0, length, column_chunk):
+        codes = BASE_CODES[matrix[:, start: start + column_chunk]]
+        present = sum((codes == code).any(axis=0).astype(np.int64) for code in range(1, len(BASES) + 1))
+        keep[start: start + column_chunk] &= present >= 2
+    return np.flatnonzero(keep)
+
+def _distance_block(codes, start, stop, column_chunk):
+    """
+    Returns (start, distances of rows start:stop to rows start: of a coded matrix).
+
+    Counts are sums of products of one-hot base indicators, which are exact in
+    float32 as long as column_chunk is below 2**24.
+    """
+    block = np.zeros((min(stop, len(codes)) - start, len(codes) - start), dtype=np.int64)
+    for col in range(0, codes.shape[1], column_chunk):
+        rows = codes[start: stop, col: col + column_chunk]
+        others = codes[start:, col: col + column_chunk]
+
+        # Columns where both samples have a base, minus those where the bases match
+        compared = (rows != 0).astype(np.float32) @ (others != 0).astype(np.float32).T
+        for code in range(1, len(BASES) + 1):
+            compared -= (rows == code).astype(np.float32) @ (others == code).astype(np.float32).T
+        block += compared.astype(np.int64)
+    return start, block
+
+def _fill(distances, results):
+    """
+    Writes (start, block) results of _distance_block into both triangles of distances.
+    """
+    for start, block in results:
+        stop = start + len(block)
+        distances[start: stop, start:] = block
+        distances[start:, start: stop] = block.T
+
+_codes = None # Coded matrix shared with each worker process
+
+def _init_worker(codes):
+    global _codes
+    _codes = codes
+
+def _pool_block(start, stop, column_chunk):
+    return _distance_block(_codes, start, stop, column_chunk)
+
+def snp_distances(
+    matrix,
+    masks=None,
+    output=None,
+    workers=1,
+    row_chunk=ROW_CHUNK,
+    column_chunk=COLUMN_CHUNK
+    ):
+    """
+    Returns the (n x n) matrix of the number of SNPs between each pair of rows of
+    a (samples x length) uint8 matrix of aligned sequences.
+
+    Only A, C, G and T are compared, so a column where either sample has an N, a
+    gap or an ambiguity code does not count. Columns masked by masks (a mask file
+    or Mask of 1-based columns) are skipped.
+
+    The matrix is computed in blocks of row_chunk rows, each over column_chunk
+    columns at a time, spread over workers processes (0 or None: one per CPU).
+    If output is given, distances are written to a memory-mapped .npy file there
+    and the memmap is returned.
+    """
+    matrix = np.asarray(matrix, dtype=np.uint8)
+    if masks is not None and not isinstance(masks, Mask):
+        masks = load_mask(masks)
+    codes = BASE_CODES[matrix[:, _informative_columns(matrix, masks, column_chunk)]]
+
+    n = len(matrix)
+    if output:
+        distances = np.lib.format.open_memmap(output, mode='w+', dtype=np.int32, shape=(n, n))
+    else:
+        distances = np.zeros((n, n), dtype=np.int32)
+
+    starts = range(0, n, row_chunk)
+    workers = min(workers or os.cpu_count() or 1, max(len(starts), 1))
+    args = (starts, [start + row_chunk for start in starts], repeat(column_chunk))
+    if workers == 1:
+        _fill(distances, map(_distance_block, repeat(codes), *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(codes,)) as pool:
+            _fill(distances, pool.map(_pool_block, *args))
+
+    if output:
+        distances.flush()
+    return distances
+
+def fasta_distances(multifasta, masks=None, output=None, workers=1, row_chunk=ROW_CHUNK, column_chunk=COLUMN_CHUNK):
+    """
+    Returns (record names, SNP distance matrix) of the records of a multi-FASTA
+    file (path or MultiFastaParser), e.g. a parsnp alignment. See snp_distances.
+    """
+    names, matrix = fasta_matrix(multifasta)
+    return names, snp_distances(
+        matrix,
+        masks=masks,
+        output=output,
+        workers=workers,
+        row_chunk=row_chunk,
+        column_chunk=column_chunk
+    )
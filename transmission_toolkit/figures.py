@@ -1,20 +1,31 @@
 """Module for generating bottleneck figures"""
 
-import matplotlib.pyplot as plt
 import datetime
 import numpy as np
 from pathlib import Path
-import os
-from transmission_toolkit.BB_Bottleneck import bb_input_data
-from transmission_toolkit.VCFtools import mask_parse
+from transmission_toolkit.BB_Bottleneck import all_pairs_parse, bb_input_data
+from transmission_toolkit.masks import load_mask
+from transmission_toolkit.utils import getpathleaf, list_vcfs
 
 
 def bar_plots(vcf_path, masks=None, mask_status='hide', min_read_depth=10, max_AF=1, parse_type='biallelic'):
-    all_pairs = []
+    """
+    Saves a barplot for every ordered pair of samples in vcf_path that share variants.
+    """
     vcf_folder = Path(vcf_path)
-    for donor_filename in os.listdir(vcf_folder):
-        for recipient_filename in os.listdir(vcf_folder):
-            if donor_filename != recipient_filename:
+    paths = {getpathleaf(path).split('.')[0]: path for path in list_vcfs(vcf_folder)}
+    all_pairs = all_pairs_parse(vcf_folder, masks=masks, mask_status=mask_status, min_read_depth=min_read_depth, max_AF=max_AF, parse_type=parse_type)
+    for (donor, recipient), shared_count in all_pairs.items():
+        if shared_count:
+            make_standard_bar_plot(
+                paths[donor],
+                paths[recipient],
+                min_read_depth=min_read_depth,
+                max_AF=max_AF,
+                parse_type=parse_type,
+                masks=masks,
+                mask_status=mask_status
+            )
 
 def make_standard_bar_plot(
     donor_filename, 
@@ -87,6 +98,8 @@ def make_standard_bar_plot(
     x = np.arange(len(positions))  # the label locations
     width = 0.35  # the width of the bars
 
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
 
     if plot_type == 'standard':
@@ -117,11 +130,24 @@ def make_standard_bar_plot(
     plt.savefig('%s_%s_allele_freq.png'%(donor_filename, recipient_filename), dpi=300, bbox_inches='tight')
     plt.show()
 
+def sv_count(complete, masked):
+    """
+    Combines two {(donor, recipient): shared count} dictionaries from all_pairs_parse
+    into {number of shared variants: [complete pairs, masked pairs]}.
+
+    shared_variant_histogram computes the same thing from a single parse.
+    """
+    counts = {}
+    for idx, pairs in enumerate((complete, masked)):
+        for shared_count in pairs.values():
+            counts.setdefault(shared_count, [0, 0])[idx] += 1
+    return counts
+
 #masked_shared_variants('mason_data/', 'default_mask.txt', max_AF=0.5, min_read_depth=10)
 #make_standard_bar_plot('COV-20200312-P2-E01-N_S31_bwamem.bam.lowfreq.vcf', 'COV-20200312-P2-E03-N_S37_bwamem.bam.lowfreq.vcf', plot_type='weighted')
-masked = all_pairs_parse('mason_data/', 'default_mask.txt', max_AF=0.5, min_read_depth=10)
-complete = all_pairs_parse('mason_data/', max_AF=0.5, min_read_depth=10)
-shared_variants = sv_count(complete, masked)
+#masked = all_pairs_parse('mason_data/', 'default_mask.txt', max_AF=0.5, min_read_depth=10)
+#complete = all_pairs_parse('mason_data/', max_AF=0.5, min_read_depth=10)
+#shared_variants = sv_count(complete, masked)
 
 
 def masked_shared_variants(sv_count):
@@ -153,6 +179,8 @@ def masked_shared_variants(sv_count):
     x = np.arange(len(sv))  # the label locations
     width = 0.35  # the width of the bars
 
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
 
 
@@ -186,10 +214,13 @@ def masked_shared_variants(sv_count):
 
 #masked_shared_variants('mason_data/', 'default_mask.txt', max_AF=0.5)
 
-def shared_positions(position_count, mask_file):
+def shared_positions(position_count, mask_file, shown_variants=20):
     """
+    Plots the shown_variants positions shared by the most pairs, coloring masked
+    positions red. position_count is {position: number of pairs}, as returned by
+    shared_position_counts.
     """
-    mask_positions = mask_parse(mask_file)
+    mask = load_mask(mask_file)
 
     sorted_pos = sorted(position_count.items(), key=lambda x: x[1], reverse=True)
     position_data, frequency_data, colors = [], [], []
@@ -197,7 +228,7 @@ def shared_positions(position_count, mask_file):
     print(sorted_pos)
     for pos in sorted_pos:
         position_data.append(pos[0])
-        if pos[0] in mask_positions:
+        if pos[0] in mask:
             colors.append("red")
         else:
             colors.append("blue")
@@ -206,6 +237,8 @@ def shared_positions(position_count, mask_file):
     x = np.arange(len(position_data))  # the label locations
     width = 0.35  # the width of the bars
 
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots()
 
   
@@ -232,4 +265,4 @@ def shared_positions(position_count, mask_file):
     
 #shared_positions('mason_data/', 'default_mask.txt', min_read_depth=10)
 
-masked_shared_variants(shared_variants)
+#masked_shared_variants(shared_variants)
@@ -0,0 +1,75 @@
+"""Module for recording the inputs each pipeline stage was last built from"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1 # Bump whenever the layout of stage records changes
+
+def file_digest(path):
+    """
+    Returns the blake2b hex digest of a file's contents.
+    """
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def digest(*parts):
+    """
+    Returns a blake2b hex digest of JSON-serializable parts, e.g. input hashes and parameters.
+    """
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.blake2b(data.encode()).hexdigest()
+
+class Manifest:
+    """
+    JSON file mapping each stage of a pipeline to a record of what it was built from.
+
+    Every change is written straight to disk, so an interrupted run keeps the
+    records of the stages it finished.
+    """
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.stages = dict()
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.stages = data['stages']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def get(self, stage, default=None):
+        """
+        Returns the record of a stage.
+        """
+        with self._lock:
+            return self.stages.get(stage, default)
+
+    def set(self, stage, record):
+        """
+        Replaces the record of a stage.
+        """
+        with self._lock:
+            self.stages[stage] = record
+            self._save()
+
+    def update(self, stage, items):
+        """
+        Adds items to the dictionary record of a stage.
+        """
+        with self._lock:
+            self.stages.setdefault(stage, dict()).update(items)
+            self._save()
+
+    def _save(self):
+        # Write to a temporary file first so the manifest is never half written
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'stages': self.stages}, f, indent=1)
+        os.replace(tmp, self.path)
@@ -0,0 +1,104 @@
+"""Module for parsing mask files into sorted, merged position intervals"""
+import os
+import bisect
+import functools
+
+import numpy as np
+
+MASK_CACHE_SIZE = 32 # Number of parsed mask files kept in memory
+
+class Mask:
+    """
+    Set of masked genome positions stored as sorted, non-overlapping intervals.
+
+    Intervals are half-open, so (start, end) masks positions start to end - 1.
+    """
+    def __init__(self, intervals):
+        starts, ends = [], []
+        for start, end in sorted(intervals):
+            if start >= end:
+                continue
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.starts = np.array(starts, dtype=np.int64)
+        self.ends = np.array(ends, dtype=np.int64)
+        self.starts.flags.writeable = False
+        self.ends.flags.writeable = False
+
+    @classmethod
+    def from_positions(cls, positions):
+        """
+        Builds a mask from individual positions.
+        """
+        return cls((pos, pos + 1) for pos in positions)
+
+    @classmethod
+    def from_file(cls, masks):
+        """
+        Parses a txt file of comma separated positions and "a-b" ranges.
+
+        As with mask_parse, a range "a-b" masks positions a to b - 1.
+        """
+        intervals = []
+        with open(masks, "r") as mask_file:
+            for line in mask_file:
+                for item in line.split(","):
+                    if not item.strip():
+                        continue
+                    nums = item.split("-")
+                    if len(nums) == 1:
+                        intervals.append((int(nums[0]), int(nums[0]) + 1))
+                    else:
+                        intervals.append((int(nums[0]), int(nums[1])))
+        return cls(intervals)
+
+    def __contains__(self, pos):
+        idx = bisect.bisect_right(self.starts, pos) - 1
+        return idx >= 0 and pos < self.ends[idx]
+
+    def __len__(self):
+        return int((self.ends - self.starts).sum())
+
+    def __iter__(self):
+        return iter(self.positions().tolist())
+
+    def intervals(self):
+        """
+        Returns a list of (start, end) tuples.
+        """
+        return list(zip(self.starts.tolist(), self.ends.tolist()))
+
+    def positions(self):
+        """
+        Returns every masked position as a sorted NumPy array.
+        """
+        if not len(self.starts):
+            return np.array([], dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in self.intervals()])
+
+    def contains(self, positions):
+        """
+        Returns a boolean array marking which of the given positions are masked.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        idx = np.searchsorted(self.starts, positions, side='right') - 1
+        inside = idx >= 0
+        inside[inside] = positions[inside] < self.ends[idx[inside]]
+        return inside
+
+@functools.lru_cache(maxsize=MASK_CACHE_SIZE)
+def _cached_mask(path, mtime, size):
+    return Mask.from_file(path)
+
+def load_mask(masks):
+    """
+    Returns the Mask for a mask file, parsing each file only once per session.
+
+    The file is parsed again if its modification time or size changes.
+    """
+    path = os.path.realpath(masks)
+    stat = os.stat(path)
+    return _cached_mask(path, stat.st_mtime_ns, stat.st_size)
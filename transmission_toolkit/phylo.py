@@ -0,0 +1,66 @@
+"""Module for building phylogenies in-process from distance matrices"""
+import numpy as np
+
+from transmission_toolkit.distance import sequence_matrix, snp_distances
+
+NEWICK_SPECIAL = set(" ,:;()[]'") # Characters that need a tip label to be quoted
+
+def _label(name):
+    if any(char in NEWICK_SPECIAL for char in name):
+        return "'" + name.replace("'", "''") + "'"
+    return name
+
+def _length(value):
+    return f'{max(value, 0.0):.6g}'
+
+def neighbor_joining(distances, names):
+    """
+    Builds a neighbor-joining tree from a square distance matrix and returns it
+    as a Newick string. Negative branch lengths are set to 0.
+    """
+    dist = np.array(distances, dtype=np.float64)
+    nodes = [_label(name) for name in names]
+    if len(nodes) != len(dist):
+        raise ValueError('There should be one name per row of the distance matrix.')
+    if not nodes:
+        raise ValueError('Cannot build a tree without samples.')
+
+    while len(nodes) > 3:
+        n = len(nodes)
+        totals = dist.sum(axis=1)
+        q = (n - 2) * dist - totals[:, None] - totals[None, :]
+        np.fill_diagonal(q, np.inf)
+        i, j = np.unravel_index(np.argmin(q), q.shape)
+        i, j = min(i, j), max(i, j)
+
+        # Join i and j under a new node stored in row i
+        length_i = 0.5 * dist[i, j] + (totals[i] - totals[j]) / (2 * (n - 2))
+        length_j = dist[i, j] - length_i
+        nodes[i] = f'({nodes[i]}:{_length(length_i)},{nodes[j]}:{_length(length_j)})'
+        new = 0.5 * (dist[i] + dist[j] - dist[i, j])
+        dist[i], dist[:, i] = new, new
+        dist[i, i] = 0
+        dist = np.delete(np.delete(dist, j, axis=0), j, axis=1)
+        del nodes[j]
+
+    if len(nodes) == 1:
+        return nodes[0] + ';'
+    if len(nodes) == 2:
+        half = _length(dist[0, 1] / 2)
+        return f'({nodes[0]}:{half},{nodes[1]}:{half});'
+    lengths = [
+        (dist[0, 1] + dist[0, 2] - dist[1, 2]) / 2,
+        (dist[0, 1] + dist[1, 2] - dist[0, 2]) / 2,
+        (dist[0, 2] + dist[1, 2] - dist[0, 1]) / 2,
+    ]
+    return '(' + ','.join(f'{node}:{_length(length)}' for node, length in zip(nodes, lengths)) + ');'
+
+def snp_tree(names, sequences):
+    """
+    Returns the neighbor-joining tree (Newick) of equal-length sequences, such as
+    consensus sequences built on one reference, using SNP distances. sequences
+    may also be a (samples x length) uint8 matrix, which is used without copying.
+    """
+    if not isinstance(sequences, np.ndarray):
+        sequences = sequence_matrix(sequences)
+    return neighbor_joining(snp_distances(sequences), names)
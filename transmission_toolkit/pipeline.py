@@ -0,0 +1,100 @@
+"""Module for running pipeline stages as a graph of dependent tasks"""
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from transmission_toolkit import profiling
+
+WORKERS = 4 # Tasks run at the same time by TaskGraph.run
+
+class ThreadBudget:
+    """
+    Caps the total number of threads used by external tools running at the same time.
+    """
+    def __init__(self, total=None):
+        self.total = max(total or os.cpu_count() or 1, 1)
+        self.free = self.total
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, threads):
+        """
+        Blocks until threads (at most the whole budget) are free and holds them
+        for the duration of the with block. Yields the number reserved.
+        """
+        threads = min(max(threads, 1), self.total)
+        with self._cond:
+            self._cond.wait_for(lambda: self.free >= threads)
+            self.free -= threads
+        try:
+            yield threads
+        finally:
+            with self._cond:
+                self.free += threads
+                self._cond.notify_all()
+
+class TaskGraph:
+    """
+    Runs named tasks on a thread pool, each once all the tasks it depends on have finished.
+
+    Tasks are functions without arguments. A running task may add further tasks,
+    e.g. one per group found by an earlier stage. Each task is timed as a
+    profiling stage named after it.
+    """
+    def __init__(self):
+        self.tasks = dict()
+        self.results = dict()
+        self._lock = threading.Lock()
+
+    def add(self, name, func, deps=()):
+        """
+        Adds a task that runs func after every task named in deps.
+        """
+        with self._lock:
+            if name in self.tasks:
+                raise ValueError(f'Duplicate task: {name}.')
+            missing = [dep for dep in deps if dep not in self.tasks]
+            if missing:
+                raise ValueError(f'Unknown dependencies of {name}: {missing}.')
+            self.tasks[name] = (func, tuple(deps))
+
+    def _run_task(self, name):
+        with profiling.stage(name):
+            return self.tasks[name][0]()
+
+    def _ready(self, done, started):
+        with self._lock:
+            return [
+                name for name, (_, deps) in self.tasks.items()
+                if name not in started and all(dep in done for dep in deps)
+            ]
+
+    def run(self, workers=WORKERS):
+        """
+        Runs every task and returns {task name: return value}.
+
+        If a task raises, no new tasks are started and the first error is raised
+        once the running tasks have finished.
+        """
+        done, started, running = set(), set(), dict()
+        error = None
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                if error is None:
+                    for name in self._ready(done, started):
+                        started.add(name)
+                        running[pool.submit(self._run_task, name)] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                        done.add(name)
+                    except Exception as err:
+                        error = error or err
+        if error is not None:
+            raise error
+        return self.results
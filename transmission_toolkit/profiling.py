@@ -0,0 +1,231 @@
+"""Module for timing pipeline stages and reporting where a run spends its time"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import cProfile
+import functools
+import threading
+import subprocess
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+REPORT_FIELDS = ['stage', 'calls', 'wall', 'cpu', 'subprocess', 'subprocess_calls', 'records', 'peak_rss']
+
+class StageRecord:
+    """
+    Measurements of one run of a stage.
+
+    cpu is the CPU time of the whole process, so it includes other threads
+    running at the same time. peak_rss is the peak resident memory (bytes) of
+    the process and its finished subprocesses so far.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.subprocess = 0.0
+        self.subprocess_calls = 0
+        self.records = 0
+        self.peak_rss = None
+
+    def add_records(self, count):
+        """
+        Adds to the number of records (variants, sequences, files...) the stage processed.
+        """
+        self.records += count
+
+    def as_dict(self):
+        record = {'stage': self.name}
+        record.update((field, getattr(self, field)) for field in REPORT_FIELDS[2:])
+        return record
+
+class Profiler:
+    """
+    Collects StageRecords of the stages run while it is enabled.
+
+    With profile_dir set, each outermost stage of a thread also runs under
+    cProfile and its statistics are dumped to profile_dir/<stage>.<n>.prof,
+    with characters other than letters, digits, '.' and '-' in the name replaced by '_'.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.profile_dir = None
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self):
+        """
+        Returns the innermost StageRecord running in this thread, or None.
+        """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures the with block as a run of stage name and yields its StageRecord.
+        """
+        record = StageRecord(name)
+        if not self.enabled:
+            yield record
+            return
+
+        stack = self._stack()
+        profile = None
+        if self.profile_dir and not stack:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError: # Another thread is already being profiled
+                profile = None
+        stack.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall
+            record.cpu = time.process_time() - cpu
+            record.peak_rss = _peak_rss()
+            stack.pop()
+            if stack:
+                # Time spent in tools counts towards every enclosing stage
+                stack[-1].subprocess += record.subprocess
+                stack[-1].subprocess_calls += record.subprocess_calls
+            with self._lock:
+                self.records.append(record)
+                count = len(self.records)
+            if profile is not None:
+                profile.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                fname = re.sub(r'[^\w.-]', '_', name) + f'.{count}.prof'
+                profile.dump_stats(os.path.join(self.profile_dir, fname))
+
+    def summary(self):
+        """
+        Returns one dictionary per stage, in the order stages first finished,
+        totalling the measurements of all its runs.
+        """
+        stages = dict()
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            total = stages.setdefault(record.name, dict.fromkeys(REPORT_FIELDS, 0))
+            total['stage'] = record.name
+            total['calls'] += 1
+            for field in ('wall', 'cpu', 'subprocess', 'subprocess_calls', 'records'):
+                total[field] += getattr(record, field)
+            total['peak_rss'] = max(total['peak_rss'], record.peak_rss or 0)
+        return list(stages.values())
+
+    def save_report(self, path):
+        """
+        Writes the stage summary to path, as CSV if it ends with .csv and as
+        JSON (with every run listed under "runs") otherwise.
+        """
+        summary = self.summary()
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(summary)
+        else:
+            with self._lock:
+                runs = [record.as_dict() for record in self.records]
+            with open(path, 'w') as f:
+                json.dump({'stages': summary, 'runs': runs}, f, indent=1)
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+PROFILER = Profiler() # Profiler used by the instrumented functions of the toolkit
+
+def enable(profile_dir=None):
+    """
+    Starts recording stages, clearing earlier records. If profile_dir is given,
+    cProfile statistics of each stage are dumped there too.
+    """
+    PROFILER.records = []
+    PROFILER.profile_dir = profile_dir
+    PROFILER.enabled = True
+
+def disable():
+    """
+    Stops recording stages. Records are kept until the next call to enable.
+    """
+    PROFILER.enabled = False
+
+def stage(name):
+    """
+    Context manager measuring its block as a run of stage name. See Profiler.stage.
+    """
+    return PROFILER.stage(name)
+
+def profiled(name=None, records=None):
+    """
+    Decorator measuring every call of a function as a run of stage name
+    (default: the function's qualified name).
+
+    records is an optional function of the return value giving the number of
+    records processed, e.g. len.
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                if records is not None:
+                    record.add_records(records(result))
+                return result
+        return wrapper
+    return decorator
+
+def add_records(count):
+    """
+    Adds to the record count of the innermost stage running in this thread.
+    """
+    record = PROFILER.current()
+    if record is not None and PROFILER.enabled:
+        record.add_records(count)
+
+def call(cmnd, **kwargs):
+    """
+    Runs subprocess.call and adds its duration to the innermost running stage.
+    """
+    start = time.perf_counter()
+    try:
+        return subprocess.call(cmnd, **kwargs)
+    finally:
+        record = PROFILER.current()
+        if record is not None and PROFILER.enabled:
+            record.subprocess += time.perf_counter() - start
+            record.subprocess_calls += 1
+
+def save_report(path):
+    """
+    Writes the report of the recorded stages to a .json or .csv file.
+    """
+    PROFILER.save_report(path)
@@ -0,0 +1,173 @@
+"""Module for reading bgzip-compressed files through their tabix (.tbi) index"""
+import io
+import os
+import gzip
+import zlib
+import struct
+
+GZIP_MAGIC = b'\x1f\x8b'
+TABIX_MAGIC = b'TBI\x01'
+LINEAR_SHIFT = 14 # Each linear index entry covers 2**14 bases
+# (shift, first bin) of each level of the tabix binning scheme, coarsest first
+BIN_LEVELS = ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681))
+
+def is_gzipped(path):
+    """
+    Checks whether a file starts with the gzip magic bytes.
+    """
+    with open(path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+def open_text(path):
+    """
+    Opens a plain or gzip/bgzip-compressed text file for reading.
+    """
+    if is_gzipped(path):
+        return io.TextIOWrapper(gzip.open(path, 'rb'))
+    return open(path, 'r')
+
+def _reg2bins(beg, end):
+    """
+    Returns the bins that may hold records overlapping [beg, end), 0-based.
+    """
+    end -= 1
+    bins = [0]
+    for shift, first in BIN_LEVELS:
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+    return bins
+
+def _read_block(f, coffset):
+    """
+    Decompresses the BGZF block starting at file offset coffset.
+
+    Returns (data, offset of the next block), or (b'', None) at the end of the file.
+    """
+    f.seek(coffset)
+    header = f.read(12)
+    if len(header) < 12:
+        return b'', None
+    if header[:2] != GZIP_MAGIC:
+        raise ValueError('Not a BGZF block.')
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = f.read(xlen)
+
+    # The BC subfield holds the total block size minus one
+    bsize, idx = None, 0
+    while idx < xlen:
+        slen = struct.unpack('<H', extra[idx + 2: idx + 4])[0]
+        if extra[idx: idx + 2] == b'BC':
+            bsize = struct.unpack('<H', extra[idx + 4: idx + 6])[0]
+        idx += 4 + slen
+    if bsize is None:
+        raise ValueError('Not a BGZF block.')
+
+    cdata = f.read(bsize - xlen - 19)
+    return zlib.decompress(cdata, -15), coffset + bsize + 1
+
+class TabixIndex:
+    """
+    Binning and linear index of a bgzip-compressed file, as written by tabix.
+    """
+    def __init__(self, names, bins, linear):
+        self.names = list(names)
+        self.bins = bins
+        self.linear = linear
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Parses a .tbi file.
+        """
+        with open(path, 'rb') as f:
+            data = gzip.decompress(f.read())
+        if data[:4] != TABIX_MAGIC:
+            raise ValueError('Not a tabix index.')
+
+        n_ref = struct.unpack_from('<i', data, 4)[0]
+        l_nm = struct.unpack_from('<i', data, 32)[0]
+        names = [name.decode() for name in data[36: 36 + l_nm].split(b'\0')[:-1]]
+
+        offset = 36 + l_nm
+        bins, linear = [], []
+        for _ in range(n_ref):
+            n_bin = struct.unpack_from('<i', data, offset)[0]
+            offset += 4
+            ref_bins = {}
+            for _ in range(n_bin):
+                bin_id, n_chunk = struct.unpack_from('<Ii', data, offset)
+                offset += 8
+                chunks = struct.unpack_from(f'<{2 * n_chunk}Q', data, offset)
+                offset += 16 * n_chunk
+                ref_bins[bin_id] = list(zip(chunks[::2], chunks[1::2]))
+            n_intv = struct.unpack_from('<i', data, offset)[0]
+            offset += 4
+            linear.append(struct.unpack_from(f'<{n_intv}Q', data, offset))
+            offset += 8 * n_intv
+            bins.append(ref_bins)
+        return cls(names, bins, linear)
+
+    def chunks(self, beg, end, name=None):
+        """
+        Returns the sorted, merged (start, end) virtual offsets of the chunks that
+        may hold records overlapping [beg, end), 0-based, on sequence name (or on
+        every sequence if name is None). Regions starting before 0 start at 0.
+        """
+        beg = max(beg, 0)
+        if end <= beg:
+            return []
+        refs = range(len(self.names)) if name is None else [self.names.index(name)]
+        chunks = []
+        for ref in refs:
+            linear = self.linear[ref]
+            min_offset = linear[min(beg >> LINEAR_SHIFT, len(linear) - 1)] if linear else 0
+            for bin_id in _reg2bins(beg, end):
+                for start, stop in self.bins[ref].get(bin_id, ()):
+                    if stop > min_offset:
+                        chunks.append((max(start, min_offset), stop))
+
+        merged = []
+        for start, stop in sorted(chunks):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+            else:
+                merged.append((start, stop))
+        return merged
+
+def index_path(path):
+    """
+    Returns the path of a bgzip-compressed file's tabix index, or None if it has none.
+    """
+    tbi = path + '.tbi'
+    if os.path.exists(tbi) and is_gzipped(path):
+        return tbi
+    return None
+
+def fetch(path, beg, end, index=None, name=None):
+    """
+    Yields the lines of a bgzip-compressed file whose chunks overlap [beg, end),
+    0-based, decompressing only the blocks those chunks cover.
+
+    Lines are yielded as text and may include records just outside the region,
+    which callers should filter out.
+    """
+    if index is None:
+        index = TabixIndex.from_file(index_path(path))
+    blocks = {}
+    with open(path, 'rb') as f:
+        for start, stop in index.chunks(beg, end, name):
+            coffset, uoffset = start >> 16, start & 0xFFFF
+            last_block, last_offset = stop >> 16, stop & 0xFFFF
+
+            # Neighbouring chunks often share a block, so keep the last one read
+            pieces = []
+            while coffset is not None and coffset <= last_block:
+                if coffset not in blocks:
+                    blocks.clear()
+                    blocks[coffset] = _read_block(f, coffset)
+                data, next_offset = blocks[coffset]
+                if coffset == last_block:
+                    data = data[:last_offset]
+                pieces.append(data[uoffset:])
+                coffset, uoffset = next_offset, 0
+            for line in b''.join(pieces).decode().splitlines(True):
+                yield line
@@ -1,23 +1,87 @@
 """Utility functions and classes"""
 
+import os
+import mmap
 import ntpath
+import functools
+
+import numpy as np
+
+REFERENCE_CACHE_SIZE = 8 # Number of reference genomes kept in memory
+MMAP_THRESHOLD = 64 * 2**20 # References at least this many bytes are memory-mapped
+INDEX_EXTENSIONS = ('.tbi', '.csi') # Index files stored next to bgzipped VCF files
+
+def _sequence_bounds(data):
+    """
+    Returns where the sequence of a one-line FASTA starts and ends in data, or
+    None if the sequence is wrapped over several lines.
+    """
+    start = data.find(b'\n') + 1
+    if not start:
+        return len(data), len(data)
+    end = data.find(b'\n', start)
+    if end == -1:
+        end = len(data)
+    elif end != len(data) - 1:
+        return None
+    while end > start and data[end - 1] in b'\r \t':
+        end -= 1
+    return start, end
+
+def _read_reference(path, size):
+    """
+    Reads the sequence of a single-sequence FASTA file into a read-only uint8 array.
+    """
+    with open(path, 'rb') as f:
+        if size < MMAP_THRESHOLD:
+            return _unwrap(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            bounds = _sequence_bounds(data)
+            if bounds is None:
+                return _unwrap(data)
+
+    # An unwrapped sequence can be used straight from the file
+    start, end = bounds
+    if start == end:
+        return np.frombuffer(b'', dtype=np.uint8)
+    seq = np.memmap(path, dtype=np.uint8, mode='r', offset=start, shape=(end - start,))
+    if (seq == ord('>')).any():
+        raise ValueError('File should only include one sequence.')
+    return seq
+
+def _unwrap(data):
+    """
+    Joins the sequence lines following the header of a FASTA file.
+    """
+    start = data.find(b'\n') + 1
+    seq = data[start:].translate(None, b' \t\r\n') if start else b''
+    if b'>' in seq:
+        raise ValueError('File should only include one sequence.')
+    return np.frombuffer(seq, dtype=np.uint8)
+
+@functools.lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def _cached_reference(path, mtime, size):
+    return _read_reference(path, size)
+
+def load_reference(sequence):
+    """
+    Returns the genome in a FASTA file as a read-only NumPy uint8 array.
+    Assumes only one sequence in the file.
+
+    Each file is read once and shared by every caller; files of at least
+    MMAP_THRESHOLD bytes are memory-mapped. Copy the array before modifying it.
+    """
+    path = os.path.realpath(sequence)
+    stat = os.stat(path)
+    return _cached_reference(path, stat.st_mtime_ns, stat.st_size)
 
 def get_seq(sequence):
     """
     Returns string representation of sequence genome given a FASTA file.
     Assumes only one sequence in the file
-    """    
-    consensus = str()
-
-    with open(sequence, 'r') as f:
-        lines = [line.strip() for line in f.readlines()]
-        for line in lines[1:]:
-            consensus += line
-            if line and line[0] == '>':
-                raise ValueError('File should only include one sequence.')
-
-    return consensus
-    
+    """
+    return load_reference(sequence).tobytes().decode('ascii')
+
 def getpathleaf(path):
     '''
     Returns the leaf of a given path.
@@ -25,4 +89,14 @@ def getpathleaf(path):
     will return file
     '''
     head, tail = ntpath.split(path)
-    return tail or ntpath.basename(head)
\ No newline at end of file
+    return tail or ntpath.basename(head)
+
+def list_vcfs(vcf_dir):
+    """
+    Returns the sorted paths of the VCF files in a directory, skipping the
+    tabix and CSI indexes of bgzipped files.
+    """
+    return [
+        os.path.join(vcf_dir, fname) for fname in sorted(os.listdir(vcf_dir))
+        if not fname.endswith(INDEX_EXTENSIONS)
+    ]
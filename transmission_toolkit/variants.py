@@ -0,0 +1,335 @@
+"""Module containing a columnar in-memory representation of VCF records"""
+import os
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from transmission_toolkit.masks import Mask
+from transmission_toolkit.utils import MMAP_THRESHOLD
+
+PARSE_TYPES = {"biallelic", "multiallelic"}
+MASK_TYPES = {"hide", "highlight"}
+
+# Columns written to disk by VariantTable.save, in constructor order
+COLUMNS = ('pos', 'ref', 'alt', 'ref_depth', 'alt_depth', 'raw_depth', 'alt_fwd', 'filter_pass', 'indel')
+COLUMN_TYPES = dict(zip(COLUMNS, (np.int64, np.int32, np.int32, np.int64, np.int64, np.int64, np.int64, bool, bool)))
+COLUMN_ALIGN = 8 # Columns are stored at offsets that are multiples of this many bytes
+
+# Alleles kept after filtering, flattened in the order extract_lfv's dictionary iterates
+Alleles = namedtuple('Alleles', ['pos', 'allele', 'freq', 'depth'])
+
+def _first_rows(keys):
+    """
+    Returns the sorted unique keys and the index of the first occurrence of each.
+    """
+    return np.unique(keys, return_index=True)
+
+def _column_layout(rows):
+    """
+    Returns (column, dtype, byte offset, byte length) of each column of a saved
+    table with the given number of rows.
+    """
+    layout, offset = [], 0
+    for column in COLUMNS:
+        dtype = np.dtype(COLUMN_TYPES[column])
+        layout.append((column, dtype, offset, rows * dtype.itemsize))
+        offset += -(-rows * dtype.itemsize // COLUMN_ALIGN) * COLUMN_ALIGN
+    return layout, offset
+
+def _last_rows(keys):
+    """
+    Returns the sorted unique keys and the index of the last occurrence of each.
+    """
+    uniq, rev_idx = np.unique(keys[::-1], return_index=True)
+    return uniq, len(keys) - 1 - rev_idx
+
+class VariantTable:
+    """
+    Stores the records of a VCF file as parallel NumPy arrays.
+
+    Each row is one VCF record. REF and ALT alleles are stored as integer codes
+    indexing into self.alleles. alt_fwd holds the ALT reads on the forward
+    strand, filter_pass whether FILTER was PASS and indel whether the record
+    is an INDEL.
+    """
+    def __init__(self, pos, ref, alt, ref_depth, alt_depth, raw_depth, alt_fwd, filter_pass, indel, alleles):
+        self.pos = np.asarray(pos, dtype=np.int64)
+        self.ref = np.asarray(ref, dtype=np.int32)
+        self.alt = np.asarray(alt, dtype=np.int32)
+        self.ref_depth = np.asarray(ref_depth, dtype=np.int64)
+        self.alt_depth = np.asarray(alt_depth, dtype=np.int64)
+        self.raw_depth = np.asarray(raw_depth, dtype=np.int64)
+        self.alt_fwd = np.asarray(alt_fwd, dtype=np.int64)
+        self.filter_pass = np.asarray(filter_pass, dtype=bool)
+        self.indel = np.asarray(indel, dtype=bool)
+        self.alleles = tuple(alleles)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.freq = self.alt_depth / self.raw_depth
+            self.ref_freq = self.ref_depth / self.raw_depth
+
+        # Tables are shared between callers, so their columns are read-only
+        for column in (self.pos, self.ref, self.alt, self.ref_depth, self.alt_depth,
+                       self.raw_depth, self.alt_fwd, self.filter_pass, self.indel,
+                       self.freq, self.ref_freq):
+            column.flags.writeable = False
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Builds a table from (position, ref, alt, raw depth, DP4, passed FILTER,
+        is INDEL) tuples, as yielded by read_records.
+        """
+        codes = {}
+        pos, ref, alt, ref_depth, alt_depth, raw_depth = [], [], [], [], [], []
+        alt_fwd, filter_pass, indel = [], [], []
+        for record_pos, record_ref, record_alt, record_depth, dp4, passed, is_indel in records:
+            pos.append(record_pos)
+            ref.append(codes.setdefault(record_ref, len(codes)))
+            alt.append(codes.setdefault(record_alt, len(codes)))
+            ref_depth.append(dp4[0] + dp4[1])
+            alt_depth.append(dp4[2] + dp4[3])
+            raw_depth.append(record_depth)
+            alt_fwd.append(dp4[2])
+            filter_pass.append(passed)
+            indel.append(is_indel)
+        return cls(pos, ref, alt, ref_depth, alt_depth, raw_depth, alt_fwd, filter_pass, indel, codes)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Loads a table written by VariantTable.save.
+
+        Tables of at least MMAP_THRESHOLD bytes are memory-mapped, holding one
+        mapping (and file descriptor) each; smaller tables are read into memory.
+        """
+        with open(os.path.join(directory, 'table.json'), 'r') as f:
+            meta = json.load(f)
+        path = os.path.join(directory, 'columns.npy')
+        if os.path.getsize(path) < MMAP_THRESHOLD:
+            mmap_mode = None
+        data = np.load(path, mmap_mode=mmap_mode)
+        layout, size = _column_layout(meta['rows'])
+        if len(data) != size:
+            raise ValueError('Saved table does not match its row count.')
+        columns = [data[offset: offset + length].view(dtype) for _, dtype, offset, length in layout]
+        return cls(*columns, meta['alleles'])
+
+    def save(self, directory):
+        """
+        Writes all columns to directory as a single .npy file of bytes, so that
+        loading a table opens one file.
+        """
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+        layout, size = _column_layout(len(self))
+        data = np.zeros(size, dtype=np.uint8)
+        for column, dtype, offset, length in layout:
+            data[offset: offset + length] = getattr(self, column).astype(dtype, copy=False).view(np.uint8)
+        np.save(os.path.join(directory, 'columns.npy'), data)
+        with open(os.path.join(directory, 'table.json'), 'w') as f:
+            json.dump({'rows': len(self), 'alleles': list(self.alleles)}, f)
+
+    def __len__(self):
+        return len(self.pos)
+
+    def region(self, start, end):
+        """
+        Returns a new table with the records at positions start to end (inclusive).
+        """
+        rows = np.flatnonzero((start <= self.pos) & (self.pos <= end))
+        return VariantTable(*(getattr(self, column)[rows] for column in COLUMNS), self.alleles)
+
+    def in_mask(self, masks):
+        """
+        Returns a boolean array marking records at masked positions.
+
+        masks can be a Mask or an iterable of positions.
+        """
+        if not isinstance(masks, Mask):
+            masks = Mask.from_positions(masks)
+        return masks.contains(self.pos)
+
+    def af_filter(self, min_AF, max_AF):
+        """
+        Returns boolean arrays marking records whose ALT and REF frequencies fall
+        in [min_AF, max_AF).
+        """
+        var_ok = (min_AF <= self.freq) & (self.freq < max_AF)
+        ref_ok = (min_AF <= self.ref_freq) & (self.ref_freq < max_AF)
+        return var_ok, ref_ok
+
+    def record_filter(self, min_read_depth=0, min_strand_depth=0, pass_only=False, exclude_indels=False):
+        """
+        Returns a boolean array marking records with a raw depth of at least
+        min_read_depth, at least min_strand_depth ALT reads on each strand, a
+        PASS filter (if pass_only) and that are not INDELs (if exclude_indels).
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if min_read_depth:
+            keep &= self.raw_depth >= min_read_depth
+        if min_strand_depth:
+            keep &= np.minimum(self.alt_fwd, self.alt_depth - self.alt_fwd) >= min_strand_depth
+        if pass_only:
+            keep &= self.filter_pass
+        if exclude_indels:
+            keep &= ~self.indel
+        return keep
+
+    def _biallelic_entries(self, rows):
+        """
+        Keeps the most frequent ALT at each position (earliest record on ties).
+        """
+        order = np.lexsort((rows, -self.freq[rows], self.pos[rows]))
+        ranked = rows[order]
+        first = np.ones(len(ranked), dtype=bool)
+        first[1:] = self.pos[ranked][1:] != self.pos[ranked][:-1]
+        winners = ranked[first]
+        _, first_idx = _first_rows(self.pos[rows])
+        return winners, rows[first_idx]
+
+    def _multiallelic_entries(self, rows):
+        """
+        Keeps every ALT at each position (latest record for repeated ALTs).
+        """
+        keys = self.pos[rows] * len(self.alleles) + self.alt[rows]
+        _, first_idx = _first_rows(keys)
+        _, last_idx = _last_rows(keys)
+        return rows[last_idx], rows[first_idx]
+
+    def reduce(
+        self,
+        min_AF=1,
+        max_AF=0,
+        parse_type='biallelic',
+        store_ref=True,
+        masks=None,
+        mask_status='hide',
+        min_read_depth=0,
+        min_strand_depth=0,
+        pass_only=False,
+        exclude_indels=False
+        ):
+        """
+        Filters and reduces the table with the same rules as extract_lfv.
+
+        Returns an Alleles tuple of arrays ordered like the legacy dictionary.
+        Records rejected by record_filter are dropped before any allele is built.
+        """
+        if min_AF < 0 or max_AF > 1 or parse_type not in PARSE_TYPES or mask_status not in MASK_TYPES:
+            raise ValueError("Invalid input.")
+        if min_read_depth < 0 or min_strand_depth < 0:
+            raise ValueError("Invalid input.")
+
+        keep = self.record_filter(min_read_depth, min_strand_depth, pass_only, exclude_indels)
+        if masks is not None and mask_status == 'hide':
+            keep &= ~self.in_mask(masks)
+        var_ok, ref_ok = self.af_filter(min_AF, max_AF)
+
+        # ALT entries, with the record that sets their value and the record
+        # that first inserted their key
+        var_rows = np.flatnonzero(keep & var_ok)
+        if parse_type == 'biallelic':
+            rows, inserted = self._biallelic_entries(var_rows)
+        else:
+            rows, inserted = self._multiallelic_entries(var_rows)
+        var_positions, pos_first = _first_rows(self.pos[var_rows])
+        pos_first = var_rows[pos_first]
+
+        e_pos = self.pos[rows]
+        e_allele = self.alt[rows]
+        e_freq = self.freq[rows]
+        e_depth = self.alt_depth[rows]
+        e_outer = pos_first[np.searchsorted(var_positions, e_pos)]
+        e_inner = inserted
+
+        # REF entries come from the first passing record at each position
+        if store_ref:
+            ref_rows = np.flatnonzero(keep & ref_ok)
+            ref_positions, ref_idx = _first_rows(self.pos[ref_rows])
+            ref_rows = ref_rows[ref_idx]
+            r_allele = self.ref[ref_rows]
+            r_freq = self.ref_freq[ref_rows]
+            r_depth = self.ref_depth[ref_rows]
+
+            # A REF equal to a stored ALT overwrites that entry in place
+            n_alleles = len(self.alleles)
+            e_keys = e_pos * n_alleles + e_allele
+            r_keys = ref_positions * n_alleles + r_allele
+            clash = np.isin(e_keys, r_keys)
+            if clash.any():
+                src = np.searchsorted(r_keys, e_keys[clash])
+                e_freq = e_freq.copy()
+                e_depth = e_depth.copy()
+                e_freq[clash] = r_freq[src]
+                e_depth[clash] = r_depth[src]
+                new = ~np.isin(r_keys, e_keys)
+                ref_positions, ref_rows = ref_positions[new], ref_rows[new]
+                r_allele, r_freq, r_depth = r_allele[new], r_freq[new], r_depth[new]
+
+            # Positions without ALT entries are appended after all others
+            r_outer = len(self) + ref_rows
+            seen = np.isin(ref_positions, var_positions)
+            r_outer[seen] = pos_first[np.searchsorted(var_positions, ref_positions[seen])]
+            r_inner = np.full(len(ref_rows), len(self), dtype=np.int64)
+
+            e_pos = np.concatenate((e_pos, ref_positions))
+            e_allele = np.concatenate((e_allele, r_allele))
+            e_freq = np.concatenate((e_freq, r_freq))
+            e_depth = np.concatenate((e_depth, r_depth))
+            e_outer = np.concatenate((e_outer, r_outer))
+            e_inner = np.concatenate((e_inner, r_inner))
+
+        order = np.lexsort((e_inner, e_outer))
+        return Alleles(e_pos[order], e_allele[order], e_freq[order], e_depth[order])
+
+    @staticmethod
+    def _best_per_position(reduced, candidates):
+        """
+        Returns the indices of the most frequent candidate at each position of
+        reduced (earliest entry on ties), ignoring frequencies of 0.
+        """
+        idx = np.flatnonzero(candidates & (reduced.freq > 0))
+        order = np.lexsort((idx, -reduced.freq[idx], reduced.pos[idx]))
+        ranked = idx[order]
+        first = np.ones(len(ranked), dtype=bool)
+        first[1:] = reduced.pos[ranked][1:] != reduced.pos[ranked][:-1]
+        return ranked[first]
+
+    def majority_alleles(self):
+        """
+        Returns (positions, allele codes) of the most frequent allele at each
+        position, as used by build_majority_consensus.
+        """
+        reduced = self.reduce(min_AF=0, max_AF=1, parse_type='biallelic', store_ref=True)
+        best = self._best_per_position(reduced, np.ones(len(reduced.pos), dtype=bool))
+        return reduced.pos[best], reduced.allele[best]
+
+    def minor_alleles(self, min_AF=0, max_AF=1):
+        """
+        Returns (positions, allele codes) of the second most frequent allele at
+        each position, as used by build_minor_consensus.
+        """
+        reduced = self.reduce(min_AF=min_AF, max_AF=max_AF, parse_type='multiallelic', store_ref=True)
+        _, group = np.unique(reduced.pos, return_inverse=True)
+        max_freq = np.full(group.max() + 1 if len(group) else 0, -np.inf)
+        np.maximum.at(max_freq, group, reduced.freq)
+        best = self._best_per_position(reduced, reduced.freq != max_freq[group])
+        return reduced.pos[best], reduced.allele[best]
+
+    def to_dict(self, *args, **kwargs):
+        """
+        Returns filtered data in the legacy form: {position: {variant: [frequency, depth]}}.
+
+        Accepts the same arguments as VariantTable.reduce.
+        """
+        reduced = self.reduce(*args, **kwargs)
+        data = {}
+        for pos, allele, freq, depth in zip(
+                reduced.pos.tolist(),
+                reduced.allele.tolist(),
+                reduced.freq.tolist(),
+                reduced.depth.tolist()):
+            data.setdefault(pos, {})[self.alleles[allele]] = [freq, depth]
+        return data
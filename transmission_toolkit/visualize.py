@@ -6,27 +6,98 @@ Module for visualizing trees using toytrees.
 import os
 import glob
 import shutil
+import threading
 
-#Third party imports
-import toytree
-import toyplot
+#Third party imports, toytree and toyplot are imported when first used
+import numpy as np
 
 # Local imports
 from transmission_toolkit.FASTAtools import FastaAligner, MultiFastaParser
-from transmission_toolkit.convertFile import vcf2fasta
-from transmission_toolkit.utils import getpathleaf
-from transmission_toolkit.VCFtools import extract_lfv
+from transmission_toolkit.convertFile import vcf2fasta_batch
+from transmission_toolkit.utils import getpathleaf, list_vcfs
+from transmission_toolkit.masks import load_mask
+from transmission_toolkit.manifest import Manifest, digest, file_digest
+from transmission_toolkit.pipeline import TaskGraph, ThreadBudget, WORKERS
+from transmission_toolkit.phylo import snp_tree
+from transmission_toolkit.profiling import profiled
+from transmission_toolkit.VCFtools import load_variant_tables
+from transmission_toolkit.consensus import build_consensus_matrix
 
 COLORS = [
     '#DC050C', '#E8601C', '#F1932D', '#F6C141', '#F7F056', '#CAE0AB',
     '#90C987', '#4EB265', '#7BAFDE', '#5289C7', '#1965B0', '#882E72'
 ]
+FAST_TREE_SIZE = 50 # Largest subgroup whose tree is built in-process instead of with parsnp
+
+def _concat(arrays, dtype):
+    return np.concatenate(arrays) if arrays else np.array([], dtype=dtype)
+
+@profiled(records=lambda result: result[0].shape[0])
+def _heatmap_matrix(
+    tables,
+    row_names,
+    min_AF=0,
+    masks=None,
+    mask_status='hide',
+    filter_columns=True,
+    store_ref=False,
+    position_range=None
+    ):
+    """
+    Builds the heatmap matrix of variant frequencies from {sample name: VariantTable}.
+
+    Row i holds the sample row_names[i] and each column a variant position. A cell
+    holds the frequency of the last allele extract_lfv lists for that sample and
+    position, or 0. Returns (matrix, positions of the kept columns).
+    """
+    mask = load_mask(masks) if masks is not None else None
+
+    # Frequency shown for each variant position of each sample
+    sample_data = dict()
+    for name, table in tables.items():
+        reduced = table.reduce(
+            min_AF=min_AF,
+            max_AF=1,
+            parse_type='multiallelic',
+            store_ref=store_ref,
+            masks=mask,
+            mask_status=mask_status
+        )
+        positions, last = np.unique(reduced.pos[::-1], return_index=True)
+        sample_data[name] = (positions, reduced.freq[::-1][last])
+    all_positions = np.unique(_concat([positions for positions, _ in sample_data.values()], np.int64))
+
+    # Sparse (row, column, frequency) entries of the matrix
+    row_idx, col_idx, freqs = [], [], []
+    for i, name in enumerate(row_names):
+        positions, freq = sample_data[name]
+        row_idx.append(np.full(len(positions), i, dtype=np.int64))
+        col_idx.append(np.searchsorted(all_positions, positions))
+        freqs.append(freq)
+    row_idx = _concat(row_idx, np.int64)
+    col_idx = _concat(col_idx, np.int64)
+    freqs = _concat(freqs, np.float64)
+
+    # filters out columns with less than 2 nonzero frequencies and columns not within range
+    keep = np.ones(len(all_positions), dtype=bool)
+    if filter_columns:
+        keep &= np.bincount(col_idx[freqs != 0], minlength=len(all_positions)) >= 2
+    if position_range:
+        keep &= (position_range[0] <= all_positions) & (all_positions <= position_range[1])
+
+    new_col = np.cumsum(keep) - 1
+    kept = keep[col_idx]
+    matrix = np.zeros((len(row_names), int(keep.sum())))
+    matrix[row_idx[kept], new_col[col_idx[kept]]] = freqs[kept]
+    return matrix, all_positions[keep]
 
 class PhyloTree:
     """
     Class for visualizing phylogenies using toytree
     """
     def __init__(self, newick, root=None, colors=COLORS):
+        import toytree
+
         tree = toytree.tree(newick, tree_format=1)
         self.tree = tree
         self.colors = colors
@@ -60,7 +131,7 @@ class PhyloTree:
         # Parse data and group records with same sequence
         data = MultiFastaParser(multifasta)
         assign_color = dict() #{name: color}
-        ref = data.records[0].name
+        ref = data.first().name
         max_idx = len(self.colors) - 1
         idx = 0
         for group in data.get_groups():
@@ -81,6 +152,7 @@ class PhyloTree:
         color_data = self.tree.get_node_values('color', show_root=1, show_tips=1)
         self.update(node_colors=color_data)
 
+    @profiled()
     def add_heatmap(
         self, 
         vcf_dir,  
@@ -94,87 +166,44 @@ class PhyloTree:
         store_ref=False,
         variant_type='major'
     ):
+        """
+        Draws the tree next to a heatmap of variant frequencies.
+
+        vcf_dir can be a directory of VCF files, a list of VCF paths or a
+        {sample name: VariantTable} dictionary.
+        """
         if position_range and not isinstance(position_range, tuple):
             raise TypeError("position_range parameter must be a tuple.")
 
-        # Create heatmap matrix from low frequency variants
-        variant_pos = set() #keeps track of var. positions in all files
-        matrix_data = dict() # maps filename to LFV data
-
-        for fname in os.listdir(vcf_dir):
-            path = os.path.join(vcf_dir, fname)
-            data = extract_lfv(
-                path, 
-                min_AF=min_AF, 
-                max_AF=1,
-                parse_type='multiallelic',
-                store_ref=store_ref, 
-                masks=masks, 
-                mask_status=mask_status
-            )
-            for pos in data:
-                variant_pos.add(pos)
-            matrix_data[fname.split('.')[0]] = data
-        variant_pos = sorted(variant_pos)
-
-        # Create matrix and keep track of which row carries which file's data
-        rows, cols = len(matrix_data), len(variant_pos)
-        matrix = [[0 for j in range(cols)] for i in range(rows)]
-        row_map = {idx: name.split('.')[0] for idx, name in enumerate(self.tree.get_tip_labels()[::-1])}
-        column2position = {idx: pos for idx, pos in enumerate(variant_pos)}
-
-        # Populate matrix with data
-        for i, data in enumerate(matrix_data):
-            name = row_map[i]
+        # Create heatmap matrix from low frequency variants, one row per tip
+        if isinstance(vcf_dir, dict):
+            tables = vcf_dir
+        else:
+            tables = load_variant_tables(vcf_dir, region=position_range)
+        row_names = []
+        for name in self.tree.get_tip_labels()[::-1][:len(tables)]:
+            name = name.split('.')[0]
             if name[0] == "'":
                 name = name[1:]
-            for j, pos in column2position.items():
-                if pos in matrix_data[name]:
-                    for var in matrix_data[name][pos]:
-                        matrix[i][j] = matrix_data[name][pos][var][0]
-                else:
-                    matrix[i][j] = 0.0
-        
-        # Keep track of columns that should be removed
-        bad_columns = set()
-        for j in range(cols):
-            
-            # filters out columns with less than 2 nonzero frequencies
-            if filter_columns:
-                count = 0 
-                for i in range(rows):
-                    if matrix[i][j] != 0:
-                        count += 1
-                if count < 2:
-                    bad_columns.add(j)
-                    
-            # filters out columns not within range
-            if position_range:
-                if not position_range[0] <= column2position[j] <= position_range[1]:
-                    bad_columns.add(j)
-        
-        # Label positions on heatmap
-        position_labels = []
-        for j in range(cols):
-            if not j in bad_columns:
-                position_labels.append(column2position[j])
-        
-        # Modify matrix to not include filtered columns
-        for i in range(rows):
-            new_row = []
-            for j in range(cols):
-                if not j in bad_columns:
-                    new_row.append(matrix[i][j])
-
-            matrix[i] = new_row
-    
-        rows = len(matrix)
-        cols = len(matrix[0])
+            row_names.append(name)
+        matrix, position_labels = _heatmap_matrix(
+            tables,
+            row_names,
+            min_AF=min_AF,
+            masks=masks,
+            mask_status=mask_status,
+            filter_columns=filter_columns,
+            store_ref=store_ref,
+            position_range=position_range
+        )
+        rows, cols = matrix.shape
 
         if cols == 0:
             raise IOError('There are no variants to make a heatmap in given VCF files.')
 
         # create a canvas
+        import toyplot
+
         canvas = toyplot.Canvas(width=width, height=height);
 
         # add tree 
@@ -186,7 +215,7 @@ class PhyloTree:
 
         # add matrix
         matrix_bounds = ('21%', '88%', '6%', '84%')
-        tlocator = toyplot.locator.Explicit(range(cols), position_labels)
+        tlocator = toyplot.locator.Explicit(range(cols), position_labels.tolist())
         rlocator = toyplot.locator.Explicit(range(rows), self.tree.get_tip_labels()[::-1])
         canvas.matrix(
             (matrix, colormap),
@@ -223,6 +252,7 @@ class PhyloTree:
     def draw(self):
         return self.tree.draw(**self.style)
     
+    @profiled()
     def save(self, canvas, output, render_type='html'):
         if render_type=='svg':
             import toyplot.svg
@@ -236,6 +266,171 @@ class PhyloTree:
         else:
             raise ValueError('Invalid render type.')
 
+def _report_errors(errors):
+    for path, err in errors.items():
+        print(f'Could not convert {path} to FASTA: {err}')
+
+def _align(genomes, ref, output_dir, threads, budget):
+    """
+    Aligns genomes (anything FastaAligner accepts) with parsnp once enough tool
+    threads are free. Returns the paths of the resulting tree and multi-FASTA file.
+    """
+    with budget.reserve(threads) as reserved:
+        FastaAligner(genomes).align(ref, output_dir=output_dir, threads=reserved)
+    return os.path.join(output_dir, 'parsnp.tree'), os.path.join(output_dir, 'parsnp.mfa')
+
+@profiled()
+def _fast_tree(consensus, output_dir):
+    """
+    Builds the neighbor-joining tree of a subgroup's ConsensusMatrix, whose first
+    row is the reference, in-process and writes it to output_dir/tree.nwk.
+
+    Returns (Newick string, reference tip name), or None if some samples have
+    multi-base alleles, e.g. indels, and need aligning.
+    """
+    if consensus.spliced:
+        return None
+    newick = snp_tree(consensus.names, consensus.matrix)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'tree.nwk'), 'w') as f:
+        f.write(newick + '\n')
+    return newick, consensus.names[0]
+
+def _subgroups(seqs, refname):
+    """
+    Returns the groups of identical sequences with more than two samples,
+    leaving out the reference.
+    """
+    groups = list()
+    for group in seqs.get_groups():
+        if refname in group:
+            group.remove(refname)
+        if len(group) > 2:
+            groups.append(group)
+    return groups
+
+def _full_tree_figures(newick, multifasta, refname, vcfdir, output_dir, render_type, min_AF, position_range):
+    """
+    Draws the full tree with and without its heatmap. Returns the colors assigned to each sample.
+    """
+    tree = PhyloTree(newick, root=refname)
+    tree.color_groups(multifasta)
+    fig = tree.draw()[0]
+    tree.save(fig,os.path.join(output_dir, 'full_tree.' + render_type))
+    tree_fig = tree.add_heatmap(vcfdir, height=400, width=1000, position_range=position_range, min_AF=min_AF)
+    tree.save(tree_fig, os.path.join(output_dir, 'full_tree_heatmap.' + render_type))
+    return tree.group_colors
+
+def _group_consensus(group, vcfdir, ref):
+    """
+    Builds the minor consensus of a subgroup's VCF files in memory.
+
+    Returns (VCF paths, ConsensusMatrix of the reference and the samples).
+    """
+    dir_map = {getpathleaf(path).split('.')[0]: path for path in list_vcfs(vcfdir)} #maps nodes back to vcf files
+    vcfpaths = [dir_map[name.split('.')[0]] for name in sorted(group)]
+    errors = {}
+    consensus = build_consensus_matrix(
+        vcfpaths, ref, consensus_type='minor', reference_name=getpathleaf(ref) + '.ref', errors=errors
+    )
+    _report_errors(errors)
+    return vcfpaths, consensus
+
+def _group_figure(group_dir, i, vcfpaths, newick, refname, color, render_type, position_range):
+    """
+    Draws a subgroup's tree and heatmap into group_dir.
+    """
+    tree = PhyloTree(newick, root=refname)
+    tree.update(node_colors=color)
+    tree.draw()
+
+    try:
+        heatmap_fig = tree.add_heatmap(
+            vcfpaths,
+            height=450,
+            width=1250,
+            position_range=position_range,
+            filter_columns=True,
+            store_ref=False,
+            variant_type='minor'
+        )
+    except IOError:
+        print('Not enough variants to make heatmap... continue!')
+        return
+
+    tree.save(heatmap_fig, os.path.join(group_dir, f'subtree_heatmap{i}.' + render_type))
+
+def _update_consensus(vcfdir, ref, tmp_path, threads, manifest):
+    """
+    Writes the consensus of the VCF files in vcfdir to tmp_path, skipping files
+    whose contents and reference match the manifest.
+
+    Returns {sample name: VCF digest} of the samples whose consensus is up to date.
+    """
+    if not os.path.exists(tmp_path):
+        os.mkdir(tmp_path)
+    vcf_paths = {getpathleaf(path).split('.')[0]: path for path in list_vcfs(vcfdir)}
+    hashes = {name: file_digest(path) for name, path in vcf_paths.items()}
+
+    record = manifest.get('consensus', {})
+    ref_hash = file_digest(ref)
+    built = record.get('samples', {}) if record.get('reference') == ref_hash else {}
+
+    # Drop consensus files of samples that were removed
+    for fname in os.listdir(tmp_path):
+        if fname.split('.')[0] not in vcf_paths:
+            os.remove(os.path.join(tmp_path, fname))
+
+    stale = [
+        name for name in vcf_paths
+        if built.get(name) != hashes[name] or not os.path.exists(os.path.join(tmp_path, name + '.fna'))
+    ]
+    written, errors = vcf2fasta_batch([vcf_paths[name] for name in stale], ref, output_dir=tmp_path, workers=threads)
+    _report_errors(errors)
+
+    samples = {name: hashes[name] for name in vcf_paths if name not in stale}
+    samples.update({name: hashes[name] for name in stale if vcf_paths[name] in written})
+    manifest.set('consensus', {'reference': ref_hash, 'samples': samples})
+    return samples
+
+def _reuse_groups(output_dir, manifest, keys):
+    """
+    Moves the directories of subgroups recorded in the manifest under the names
+    of their new position in keys and deletes the rest.
+
+    Returns the (1-based) indices of the groups that still have to be built.
+    """
+    old = manifest.get('groups', {})
+    wanted = {key: i for i, key in enumerate(keys, 1)}
+
+    # Move reusable groups aside first, since their new names may be taken
+    staged = {}
+    for fname in os.listdir(output_dir):
+        path = os.path.join(output_dir, fname)
+        if not (fname.startswith('group_') and os.path.isdir(path)):
+            continue
+        key = old.get(fname)
+        if key in wanted and key not in staged:
+            staged[key] = (os.path.join(output_dir, '.' + fname), int(fname[len('group_'):]))
+            os.rename(path, staged[key][0])
+        else:
+            shutil.rmtree(path)
+
+    reused = {}
+    for key, (path, old_i) in staged.items():
+        i = wanted[key]
+        group_dir = os.path.join(output_dir, f'group_{i}')
+        os.rename(path, group_dir)
+        for fname in os.listdir(group_dir):
+            if fname.startswith(f'subtree_heatmap{old_i}.'):
+                os.rename(
+                    os.path.join(group_dir, fname),
+                    os.path.join(group_dir, f'subtree_heatmap{i}.' + fname.split('.', 1)[1])
+                )
+        reused[f'group_{i}'] = key
+    manifest.set('groups', reused)
+    return [i for key, i in wanted.items() if key not in staged]
+
 def visualize(
     vcfdir, 
     ref, 
@@ -246,7 +441,11 @@ def visualize(
     min_AF=0,
     masks=None,
     mask_status='hide',
-    position_range=None
+    position_range=None,
+    workers=WORKERS,
+    tool_threads=None,
+    incremental=False,
+    fast_tree_size=FAST_TREE_SIZE
     ):
     '''
     Function that generates figures on the full tree and subtree phylogenies given
@@ -254,6 +453,21 @@ def visualize(
 
     It should be noted that running this provides less customizablity than using the
     PhyloTree class methods themselves.
+
+    The stages run as a task graph on workers threads: subgroups are processed
+    concurrently and figures are drawn while other groups are being aligned.
+    Each parsnp run uses threads threads, and at most tool_threads (default: the
+    number of CPUs) are used by parsnp runs at the same time.
+
+    With incremental=True, output_dir may already hold the results of an earlier
+    run. A manifest of the inputs and parameters of each stage is kept in it and
+    only consensus files of new or changed VCFs, the alignment and figures they
+    affect and subgroups whose members changed are rebuilt. The consensus files
+    in tmp are kept as a cache.
+
+    Subgroups of at most fast_tree_size samples skip parsnp: their consensus
+    sequences already line up with the reference, so a neighbor-joining tree of
+    SNP distances is built in-process instead. Set it to 0 to align every subgroup.
     '''
 
     # Check if path exists
@@ -263,115 +477,114 @@ def visualize(
         raise FileNotFoundError(f"File does not exist: {ref}")
 
     # Make new directory
-    os.mkdir(output_dir)
-
-    # Generate fasta file and put those files in tmp folder
+    if incremental:
+        os.makedirs(output_dir, exist_ok=True)
+    else:
+        os.mkdir(output_dir)
     tmp_path = os.path.join(output_dir, "tmp")
-    os.mkdir(tmp_path)
-    for fn in os.listdir(vcfdir):
-        fp = os.path.join(vcfdir, fn)
-        vcf2fasta(
-            fp, 
-            ref, 
-            output_dir=tmp_path,
-            min_AF=min_AF,
-            max_AF=1,
-            parse_type='biallelic',
-            masks=masks,
-            mask_status=mask_status,
-        )
-
-    # Align fasta files using parsnp and put them it in parsnp folder
     parsnp = os.path.join(output_dir, 'parsnp')
-    tmpdata = FastaAligner(tmp_path)
-    tmpdata.align(ref, output_dir=parsnp)
-    newick = os.path.join(parsnp, 'parsnp.tree')
-
-    # Parse multifasta
-    multifasta = os.path.join(parsnp, 'parsnp.mfa')
-    seqs = MultiFastaParser(multifasta)
-    refname = seqs.records[0].name #assumes ref seq is first record in multifasta (is the case w/ parsnp)
-
-    # Run normal tree stuff or whatever
-    tree = PhyloTree(newick, root=refname)
-    tree.color_groups(multifasta)
-    fig = tree.draw()[0]
-    tree.save(fig,os.path.join(output_dir, 'full_tree.' + render_type))
-    tree_fig = tree.add_heatmap(vcfdir, height=400, width=1000, position_range=position_range, min_AF=min_AF)
-    tree.save(tree_fig, os.path.join(output_dir, 'full_tree_heatmap.' + render_type))
-
-    # store colors assigned
-    assigned_colors = tree.group_colors
-
-    # Group vcf files into list of groups
-    old_groups = list(seqs.get_groups())
-    groups = list()
-    for group in old_groups:
-        if refname in group:
-            group.remove(refname)
-        if len(group) > 2:
-            groups.append(group)
-            
-    dir_map = {name.split('.')[0]: name for name in os.listdir(vcfdir)} #maps nodes back to vcf files
-
-    # For each subgroup, generate subtree heatmap figure
-    i = 1
-    for group in groups:
-        group_dir = os.path.join(output_dir, f'group_{i}')
-        group_tmp = os.path.join(group_dir, 'tmp')
-        tmp_vcf = os.path.join(group_dir, 'vcf')
-        os.mkdir(group_dir)
-        os.mkdir(group_tmp)
-        os.mkdir(tmp_vcf)
-        for name in group:
-            splitname = name.split('.')[0]
-            color = assigned_colors[splitname]
-            vcf = dir_map[splitname]
-            vcfpath = os.path.join(vcfdir, vcf)
-            shutil.copy(vcfpath, tmp_vcf)
-            vcf2fasta(
-                vcfpath, 
-                ref, 
-                output_dir=group_tmp, 
-                min_AF=0, 
-                max_AF=1, 
-                parse_type='biallelic',
-                masks=masks, 
-                mask_status=mask_status,
-                consensus_type='minor'
-            )
-
-        parsnp = os.path.join(group_dir, 'parsnp')
-        tmpdata = FastaAligner(group_tmp)
-        tmpdata.align(ref, output_dir=parsnp)
-
-        newick = os.path.join(parsnp, 'parsnp.tree')
-        multifasta = os.path.join(parsnp, 'parsnp.mfa')
+    manifest = Manifest(output_dir) if incremental else None
+
+    graph = TaskGraph()
+    budget = ThreadBudget(tool_threads)
+    render_lock = threading.Lock() # toytree and toyplot are not thread-safe
+
+    def consensus():
+        # Generate fasta file and put those files in tmp folder
+        if incremental:
+            return _update_consensus(vcfdir, ref, tmp_path, threads, manifest)
+        os.mkdir(tmp_path)
+        _, errors = vcf2fasta_batch(vcfdir, ref, output_dir=tmp_path, workers=threads)
+        _report_errors(errors)
+
+    def align():
+        # Align fasta files using parsnp and put them it in parsnp folder
+        paths = os.path.join(parsnp, 'parsnp.tree'), os.path.join(parsnp, 'parsnp.mfa')
+        if incremental:
+            key = digest(file_digest(ref), graph.results['consensus'])
+            record = manifest.get('parsnp', {})
+            if record.get('key') == key and all(os.path.exists(path) for path in paths):
+                return paths
+            manifest.set('parsnp', {})
+        paths = _align(tmp_path, ref, parsnp, threads, budget)
+        if incremental:
+            manifest.set('parsnp', {'key': key})
+        return paths
+
+    def cleanup():
+        # Get rid of tmp directory
+        if not incremental:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def full_tree():
+        newick, multifasta = graph.results['align']
         seqs = MultiFastaParser(multifasta)
-        refname = seqs.records[0].name #assumes ref seq is first record in multifasta (is the case w/ parsnp)
-
-        tree = PhyloTree(newick, root=refname)
-        tree.update(node_colors=color)
-        tree.draw()
-
-        try:
-            heatmap_fig = tree.add_heatmap(
-                tmp_vcf, 
-                height=450, 
-                width=1250, 
-                position_range=position_range, 
-                filter_columns=True,
-                store_ref=False,
-                variant_type='minor'
-            )
-        except IOError:
-            print('Not enough variants to make heatmap... continue!')
-            i += 1
-            continue
-
-        tree.save(heatmap_fig, os.path.join(group_dir, f'subtree_heatmap{i}.' + render_type))
-        shutil.rmtree(group_tmp, ignore_errors=True)
-        i += 1
-
-    # Get rid of tmp directory
-    shutil.rmtree(tmp_path, ignore_errors=True)
+        refname = seqs.first().name #assumes ref seq is first record in multifasta (is the case w/ parsnp)
+        figures = [os.path.join(output_dir, fname + '.' + render_type) for fname in ('full_tree', 'full_tree_heatmap')]
+        if incremental:
+            key = digest(manifest.get('parsnp'), min_AF, position_range, render_type)
+            record = manifest.get('full_tree', {})
+            if record.get('key') == key and all(os.path.exists(path) for path in figures):
+                assigned_colors = record['colors']
+            else:
+                assigned_colors = None
+        if not incremental or assigned_colors is None:
+            with render_lock:
+                assigned_colors = _full_tree_figures(
+                    newick, multifasta, refname, vcfdir, output_dir, render_type, min_AF, position_range
+                )
+            if incremental:
+                manifest.set('full_tree', {'key': key, 'colors': assigned_colors})
+
+        # For each subgroup, generate subtree heatmap figure
+        groups = _subgroups(seqs, refname)
+        colors = [assigned_colors[list(group)[-1].split('.')[0]] for group in groups]
+        indices = range(1, len(groups) + 1)
+        if incremental:
+            hashes = graph.results['consensus']
+            keys = [
+                digest(sorted((name, hashes.get(name.split('.')[0])) for name in group),
+                       file_digest(ref), color, position_range, render_type, len(group) <= fast_tree_size)
+                for group, color in zip(groups, colors)
+            ]
+            indices = _reuse_groups(output_dir, manifest, keys)
+        for i in indices:
+            key = keys[i - 1] if incremental else None
+            add_group(i, groups[i - 1], colors[i - 1], key)
+
+    def add_group(i, group, color, key):
+        name = f'group_{i}'
+
+        def group_consensus():
+            os.mkdir(os.path.join(output_dir, name))
+            return _group_consensus(group, vcfdir, ref)
+
+        def group_align():
+            _, consensus = graph.results[name + '/consensus']
+            if len(group) <= fast_tree_size:
+                tree = _fast_tree(consensus, os.path.join(output_dir, name))
+                if tree is not None:
+                    return tree
+            records = consensus.records()[1:] #the reference is passed to parsnp separately
+            newick, multifasta = _align(records, ref, os.path.join(output_dir, name, 'parsnp'), threads, budget)
+            return newick, MultiFastaParser(multifasta).first().name #ref seq is the first record in parsnp output
+
+        def group_figure():
+            vcfpaths, _ = graph.results[name + '/consensus']
+            newick, refname = graph.results[name + '/align']
+            with render_lock:
+                _group_figure(
+                    os.path.join(output_dir, name), i, vcfpaths, newick, refname, color, render_type, position_range
+                )
+            if incremental:
+                manifest.update('groups', {name: key})
+
+        graph.add(name + '/consensus', group_consensus, deps=['full_tree'])
+        graph.add(name + '/align', group_align, deps=[name + '/consensus'])
+        graph.add(name + '/figure', group_figure, deps=[name + '/align'])
+
+    graph.add('consensus', consensus)
+    graph.add('align', align, deps=['consensus'])
+    graph.add('cleanup', cleanup, deps=['align'])
+    graph.add('full_tree', full_tree, deps=['align'])
+    graph.run(workers=workers)